@@ -0,0 +1,123 @@
+# Standard library imports.
+import logging
+import pathlib
+import random
+import timeit
+
+# Related third party imports.
+import numpy as np
+
+# Local application/library specific imports.
+from src.models.network_operator import NetworkOperator
+from src.models.vSDN_request import vSDN_request
+
+network_folder = pathlib.Path(
+    __file__).resolve().parents[1] / "data/processed/networks"
+network_name = '25_italy'
+latency_factor = 0.5
+shortest_k = 16
+n_hypervisors = 4
+request_count = 400
+max_request_size = 8
+n_attribute_reads = 1_000_000
+repeat = 5
+
+
+class HookedNetworkOperator(NetworkOperator):
+    """NetworkOperator with the former pass-through __getattribute__."""
+
+    def __getattribute__(self, name: str):
+        return object.__getattribute__(self, name)
+
+
+class HookedvSDN_request(vSDN_request):
+    """vSDN_request with the former pass-through __getattribute__."""
+
+    __slots__ = ()
+
+    def __getattribute__(self, name: str):
+        return object.__getattribute__(self, name)
+
+
+def get_requests(request_class, n_nodes, seed=0):
+    rng = np.random.default_rng(seed)
+    requests = []
+    for _ in range(request_count):
+        size = int(rng.integers(2, max_request_size + 1))
+        switches = sorted(rng.choice(n_nodes, size, replace=False).tolist())
+        requests.append(
+            request_class(controller=int(rng.choice(switches)),
+                          switches=switches,
+                          TTL=5,
+                          QoS=1,
+                          time_=0))
+    return requests
+
+
+def attribute_access(obj, name):
+    """Seconds per attribute read, best of repeat runs."""
+    timer = timeit.Timer(f"obj.{name}", globals={'obj': obj})
+    return min(timer.repeat(repeat=repeat,
+                            number=n_attribute_reads)) / n_attribute_reads
+
+
+def request_throughput(network_operator, requests):
+    """Requests processed per second by process_vSDN_requests."""
+    times = []
+    for _ in range(repeat):
+        network_operator.delete_all_vSDNs()
+        random.seed(0)
+        start = timeit.default_timer()
+        network_operator.process_vSDN_requests(requests, deploy=True)
+        times.append(timeit.default_timer() - start)
+    return len(requests) / min(times)
+
+
+def get_network_operator(operator_class):
+    no = operator_class(path=str(network_folder / f"{network_name}.gml"))
+    no.set_max_length(latency_factor=latency_factor)
+    no.set_shortest_k(shortest_k=shortest_k)
+    no.control_path_calculation()
+    random.seed(0)
+    np.random.seed(0)
+    no.hypervisor_placement(hp_type='heuristics',
+                            hp_objective='hypervisor count',
+                            n_hypervisors=n_hypervisors,
+                            n_extra_hypervisors=0,
+                            repeat=3,
+                            heuristic_randomness=0.2)
+    return no
+
+
+def main():
+    logging.basicConfig(
+        format="[%(funcName)30s()] %(message)s",
+        level=logging.INFO,
+        force=True,
+    )
+    classes = {
+        'hooked': (HookedNetworkOperator, HookedvSDN_request),
+        'plain': (NetworkOperator, vSDN_request),
+    }
+
+    results = {}
+    for label, (operator_class, request_class) in classes.items():
+        no = get_network_operator(operator_class)
+        requests = get_requests(request_class, len(no.nodes))
+        results[label] = {
+            'network operator read [ns]':
+            1e9 * attribute_access(no, 'info'),
+            'vSDN request read [ns]':
+            1e9 * attribute_access(requests[0], 'switches'),
+            'process_vSDN_requests [requests/s]':
+            request_throughput(no, requests),
+        }
+
+    for metric in results['plain']:
+        hooked, plain = results['hooked'][metric], results['plain'][metric]
+        logging.info(f"{metric:35s} hooked {hooked:12.1f} "
+                     f"plain {plain:12.1f} ratio {hooked / plain:5.2f}")
+
+
+if __name__ == '__main__':
+    main()
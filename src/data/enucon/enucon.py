@@ -5,6 +5,7 @@ import src.data.enucon.sort_vertices as sortv
 from time import time
 import argparse
 import sys
+import numpy as np
 sys.setrecursionlimit(10000000)
 
 # NETWORK_NAME="50_germany"; for i in {2..18}; do python enucon.py simple-return 120 ${i} ../../../data/processed/networks/txt_format/${NETWORK_NAME}.txt ../../../data/processed/requests/${NETWORK_NAME}/; done
@@ -42,6 +43,13 @@ parser.add_argument(
     help=
     'If this value is True, the parameter k is the order of the biggest connected component minus the input parameter'
 )
+parser.add_argument(
+    '--binary',
+    default=False,
+    action='store_true',
+    help=('If set, the subgraphs are written as fixed-width rows of uint8 '
+          'node ids (uint16 for node ids above 255) to a .subgraphs.uint8 '
+          '(.subgraphs.uint16) file instead of text lines'))
 args = parser.parse_args()
 
 # load file and built graph
@@ -72,7 +80,12 @@ out_line = (name.rjust(30) + str(graph.vcount()).rjust(9) +
 # file that stores the vertices of each size k subgraph
 filename = str(args.folder) + "/" + str(name)[:-4] + "." + str(
     args.parameter) + ".subgraphs"
-subgraph_file = open(filename, 'w+')
+if args.binary:
+    dtype = enu.binary_subgraph_dtype(graph)
+    filename += "." + np.dtype(dtype).name
+    subgraph_file = enu.BinarySubgraphWriter(open(filename, 'wb'), dtype)
+else:
+    subgraph_file = open(filename, 'w+')
 # log file that stores algorithm specific information
 filename_log = str(args.folder) + "/" + str(name) + "." + str(
     args.parameter) + ".log"
@@ -1,6 +1,7 @@
 from igraph import *
 from time import time
 import networkx as nx
+import numpy as np
 from itertools import combinations
 import queue
 import bisect
@@ -33,6 +34,48 @@ def print_names(graph, vertices):
     return out_line + "\n"
 
 
+def binary_subgraph_dtype(graph):
+    """Return the smallest unsigned integer type of BinarySubgraphWriter
+    that holds the vertex names written by print_names.
+    graph: Is the (i)graph, its vertex names have to be integers."""
+    max_id = max((int(name) for name in graph.vs["name"]), default=0)
+    for dtype in (np.uint8, np.uint16):
+        if max_id <= np.iinfo(dtype).max:
+            return dtype
+    raise ValueError("Vertex name " + str(max_id) + " does not fit in uint16")
+
+
+class BinarySubgraphWriter:
+    """Writes the lines of print_names as fixed-width rows of node ids.
+    file: Is the binary file the rows are written to.
+    dtype: Is the unsigned integer type of the node ids, a ValueError is
+    raised for node ids out of its range."""
+    def __init__(self, file, dtype, buffer_size=2**16):
+        self.file = file
+        self.dtype = dtype
+        self.buffer_size = buffer_size
+        self.buffer = []
+
+    def write(self, line):
+        self.buffer.append([int(entry) for entry in line.split()])
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            rows = np.array(self.buffer)
+            info = np.iinfo(self.dtype)
+            if rows.min() < info.min or rows.max() > info.max:
+                raise ValueError("Node ids out of the " + info.dtype.name +
+                                 " range")
+            rows.astype(self.dtype).tofile(self.file)
+            self.buffer = []
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
 # new version of exgen with break condition
 def enu_all_subgraphs_return(graph, k, time_max, subgraph_file, start_time,
                              options):
@@ -1,15 +1,20 @@
 # Standard library imports.
+import bisect
 import itertools
+import concurrent.futures
+import multiprocessing
 
 # Related third party imports.
 import numpy as np
 import networkx as nx
+import scipy.sparse
 import copy
 import random
 from tqdm import tqdm
 
 # Local application/library specific imports.
 import src.data.routing as routing
+from src.data.path_store import PathStore
 
 
 # Latency matrix of shortest paths
@@ -57,18 +62,28 @@ def is_disjoint(p, q):
         return p_.isdisjoint(q_)
 
 
-# Check if there are 2 disjoint paths in pathlist P and Q
+# Check if there are 2 disjoint paths in path record lists P and Q
 def is_path_disjoint(P, Q):
     for p, q in itertools.product(P, Q):
-        if is_disjoint(p, q):  # and is_low_latency(p) and is_low_latency(q):
+        if routing.is_disjoint_mask(p, q):
             return True
     return False
 
 
 # Can f and f_ cover c in a path disjoint way?
 def is_path_disjoint_cover(G, f, f_, c, max_length, shortest_k: int = 10):
-    P = routing.get_paths(G, f, c, max_length, shortest_k=shortest_k)
-    Q = routing.get_paths(G, f_, c, max_length, shortest_k=shortest_k)
+    P = routing.get_paths(G,
+                          f,
+                          c,
+                          max_length,
+                          shortest_k=shortest_k,
+                          with_length=True)
+    Q = routing.get_paths(G,
+                          f_,
+                          c,
+                          max_length,
+                          shortest_k=shortest_k,
+                          with_length=True)
     return is_path_disjoint(P, Q)
 
 
@@ -136,14 +151,21 @@ def is_quartet_possible(all_paths, c, h, h_, s, max_length):
         if p['length'] + all_paths[(c, h_)][0]['length'] < max_length
     ]
 
-    for pc, qc, ps, qs in itertools.product(Pc, Qc, Ps, Qs):
-        if (pc['length'] + ps['length'] < max_length
-                and qc['length'] + qs['length'] < max_length
-                and is_disjoint(pc['path'], qc['path'])
-                and is_disjoint(ps['path'], qs['path'])
-                and is_disjoint(pc['path'], qs['path'])
-                and is_disjoint(qc['path'], ps['path'])):
-            return True
+    # Same checks as itertools.product(Pc, Qc, Ps, Qs), but the edge bitmasks
+    # let us prune a branch as soon as two of its paths share a link.
+    for pc in Pc:
+        for qc in Qc:
+            if pc['mask'] & qc['mask']:
+                continue
+            for ps in Ps:
+                if (pc['length'] + ps['length'] >= max_length
+                        or qc['mask'] & ps['mask']):
+                    continue
+                pc_ps_mask = pc['mask'] | ps['mask']
+                for qs in Qs:
+                    if (qc['length'] + qs['length'] < max_length
+                            and not pc_ps_mask & qs['mask']):
+                        return True
     return False
 
 
@@ -153,66 +175,460 @@ def is_triangle_quartet_possible(all_paths, c, h, h_, s, max_length):
     Qc = all_paths[(c, h_)]
     Ps = all_paths[(h, s)]
     Qs = all_paths[(h_, s)]
-    for qc, ps, qs in itertools.product(Qc, Ps, Qs):
-        if (is_disjoint(ps['path'], qs['path'])
-                and is_disjoint(qc['path'], ps['path'])
-                and ps['length'] < max_length
-                and qc['length'] + qs['length'] < max_length):
-            return True
+    for ps in Ps:
+        if ps['length'] >= max_length:
+            continue
+        for qc in Qc:
+            if qc['mask'] & ps['mask']:
+                continue
+            for qs in Qs:
+                if (qc['length'] + qs['length'] < max_length
+                        and not ps['mask'] & qs['mask']):
+                    return True
     return False
 
 
+def get_path_arrays(all_paths):
+    """Pack the path records of every node pair into NumPy arrays.
+
+    Returns a dict (u, v) -> (lengths, masks), where masks holds the edge
+    bitmask of each path as a row of uint64 words."""
+    if isinstance(all_paths, PathStore):
+        return all_paths.path_arrays()
+    n_bits = max((p['mask'].bit_length() for paths in all_paths.values()
+                  for p in paths),
+                 default=0)
+    n_words = max(1, -(-n_bits // 64))
+
+    path_arrays, packed = {}, {}
+    for key, paths in all_paths.items():
+        if id(paths) not in packed:
+            lengths = np.array([p['length'] for p in paths], dtype=float)
+            masks = np.array([[(p['mask'] >> (64 * i)) & 0xFFFFFFFFFFFFFFFF
+                               for i in range(n_words)] for p in paths],
+                             dtype=np.uint64).reshape(len(paths), n_words)
+            packed[id(paths)] = (lengths, masks)
+        path_arrays[key] = packed[id(paths)]
+    return path_arrays
+
+
+def control_path_unions(path_arrays,
+                        c,
+                        h,
+                        s,
+                        max_length,
+                        with_length: bool = False):
+    """Edge bitmasks of every c-h-s control path shorter than max_length.
+
+    Each row is the union of a controller-hypervisor and a
+    hypervisor-switch path whose total length is below max_length."""
+    lc, mc = path_arrays[(c, h)]
+    ls, ms = path_arrays[(h, s)]
+    lengths = lc[:, np.newaxis] + ls[np.newaxis, :]
+    i, j = np.nonzero(lengths < max_length)
+    if with_length:
+        return lengths[i, j], mc[i] | ms[j]
+    return mc[i] | ms[j]
+
+
+def _disjoint_chunks(A, B, chunk_size):
+    """Yield (start, disjoint) for chunks of the rows of A, where disjoint
+    is the boolean matrix of the chunk rows and the rows of B that share
+    no bit. Each chunk holds about chunk_size elements."""
+    rows = max(1, chunk_size // B.size)
+    for start in range(0, len(A), rows):
+        A_ = A[start:start + rows]
+        overlap = A_[:, 0, np.newaxis] & B[np.newaxis, :, 0]
+        for w in range(1, A.shape[1]):
+            overlap |= A_[:, w, np.newaxis] & B[np.newaxis, :, w]
+        yield start, overlap == 0
+
+
+def _segment_starts(arrays, indexes):
+    return np.cumsum([0] + [len(arrays[i]) for i in indexes[:-1]])
+
+
+def _any_disjoint(A, B, b_starts, chunk_size):
+    """Whether any row of A is disjoint from a row of each segment of B,
+    where the segments of B start at the rows b_starts.
+
+    The rows of A are compared in chunks that double in size, and the
+    segments of B with a disjoint row are dropped after each chunk, so a
+    disjoint row found early saves the remaining comparisons like the
+    short-circuiting path by path checks."""
+    disjoint = np.zeros(len(b_starts), dtype=bool)
+    sizes = np.diff(np.append(b_starts, len(B)))
+    open_, B_, starts = np.arange(len(b_starts)), B, b_starts
+    start, rows = 0, 8
+    while start < len(A):
+        found = np.zeros(len(starts), dtype=bool)
+        for _, chunk in _disjoint_chunks(A[start:start + rows], B_,
+                                         chunk_size):
+            found |= np.logical_or.reduceat(chunk.any(axis=0), starts)
+        start, rows = start + rows, 2 * rows
+        if found.any():
+            disjoint[open_[found]] = True
+            open_ = open_[~found]
+            if not len(open_):
+                break
+            B_ = B[np.repeat(~disjoint, sizes)]
+            starts = np.cumsum(np.append(0, sizes[open_][:-1]))
+    return disjoint
+
+
+def _pair_segments(A_list, B_list, symmetric):
+    """Yield (i, j_list, rows, b_starts) for every non-empty A_list[i],
+    where rows slices the rows of the non-empty arrays B_list[j] of j_list
+    from the concatenated B_list, and b_starts are their first rows within
+    the slice. With symmetric, j_list only holds j > i."""
+    ib = [j for j, B in enumerate(B_list) if len(B)]
+    b_starts = _segment_starts(B_list, ib)
+    for i, A in enumerate(A_list):
+        first = bisect.bisect_right(ib, i) if symmetric else 0
+        if len(A) and first < len(ib):
+            yield (i, ib[first:], slice(b_starts[first], None),
+                   b_starts[first:] - b_starts[first])
+
+
+def disjoint_pair_matrix(A_list,
+                         B_list,
+                         chunk_size: int = 2**22,
+                         symmetric: bool = False):
+    """Check every (A, B) pair of bitmask arrays for rows sharing no bit.
+
+    Returns a boolean matrix whose element (i, j) is True if a row of
+    A_list[i] and a row of B_list[j] are disjoint. Each A is compared with
+    the rows of all B arrays in chunks of about chunk_size elements that
+    are reduced right away, so the memory usage is bounded by chunk_size.
+    With symmetric (A_list is B_list), only the upper triangle j > i is
+    computed."""
+    result = np.zeros((len(A_list), len(B_list)), dtype=bool)
+    segments = list(_pair_segments(A_list, B_list, symmetric))
+    if not segments:
+        return result
+
+    B = np.concatenate(B_list)
+    for i, j_list, rows, b_starts in segments:
+        result[i, j_list] = _any_disjoint(A_list[i], B[rows], b_starts,
+                                          chunk_size)
+    return result
+
+
+def _min_disjoint_bound(A, B, la, lb, b_starts, chunk_size):
+    """Smallest max(la, lb) over the disjoint rows of A and of each
+    segment of B, where the segments of B start at the rows b_starts."""
+    bounds = np.full(len(b_starts), np.inf)
+    for start, chunk in _disjoint_chunks(A, B, chunk_size):
+        chunk_bounds = np.maximum(la[start:start + len(chunk), np.newaxis],
+                                  lb[np.newaxis, :])
+        chunk_bounds[~chunk] = np.inf
+        np.minimum(bounds,
+                   np.minimum.reduceat(chunk_bounds.min(axis=0), b_starts),
+                   out=bounds)
+    return bounds
+
+
+def disjoint_pair_bounds(A_list,
+                         B_list,
+                         la_list,
+                         lb_list,
+                         chunk_size: int = 2**22,
+                         symmetric: bool = False):
+    """Lowest latency bound of every (A, B) pair of bitmask arrays.
+
+    Like disjoint_pair_matrix, but element (i, j) is the smallest
+    max(la, lb) over the disjoint rows of A_list[i] and B_list[j], where
+    la_list and lb_list hold the lengths of the rows (np.inf if there are
+    no disjoint rows). The bounds of each chunk are reduced with
+    np.minimum right away, so the memory usage is bounded by chunk_size."""
+    result = np.full((len(A_list), len(B_list)), np.inf)
+    segments = list(_pair_segments(A_list, B_list, symmetric))
+    if not segments:
+        return result
+
+    B, lb = np.concatenate(B_list), np.concatenate(lb_list)
+    for i, j_list, rows, b_starts in segments:
+        result[i, j_list] = _min_disjoint_bound(A_list[i], B[rows],
+                                                la_list[i], lb[rows],
+                                                b_starts, chunk_size)
+    return result
+
+
+def _add_quartet(quartets, q):
+    """Add the quartet q to the structures Q, Qc, Qs, Qcs and Qhh."""
+    Q, Qc, Qs, Qcs, Qhh = quartets
+    c, h, h_, s = q
+    Q.add(q)
+    Qc.setdefault(c, []).append(q)
+    Qs.setdefault(s, []).append(q)
+    Qcs.setdefault((c, s), set()).add((min(h, h_), max(h, h_)))
+    Qhh.setdefault((min(h, h_), max(h, h_)), set()).add((c, s))
+
+
+def _direct_quartet_bounds(c, s, H, all_paths, max_length):
+    """Latency bounds of the (c,c,c,c) and (c,s,s,s) quartets, which need
+    no disjointness check."""
+    bounds = {}
+    # (c,c,c,c)
+    if c == s and c in H:
+        bounds[(c, c, c, c)] = -np.inf
+
+    # (c,s,s,s)
+    if (c != s and s in H and all_paths[(c, s)]
+            and all_paths[(c, s)][0]['length'] < max_length):
+        bounds[(c, s, s, s)] = all_paths[(c, s)][0]['length']
+    return bounds
+
+
+def _check_quartets_loop(all_paths, c, s, H_, triangle, max_length):
+    """Possible (c,c,h,s) and (c,h,h_,s) quartets, checked path by path."""
+    possible_h = {}
+    if triangle:
+        possible_h = {
+            h: is_triangle_quartet_possible(all_paths, c, c, h, s,
+                                            max_length)
+            for h in H_
+        }
+    possible_hh = {(h, h_): is_quartet_possible(all_paths, c, h, h_, s,
+                                                max_length)
+                   for h, h_ in itertools.combinations(H_, 2)}
+    return possible_h, possible_hh
+
+
+def _check_quartets_vectorized(path_arrays, c, s, H_, triangle, max_length):
+    """Possible (c,c,h,s) and (c,h,h_,s) quartets, checked with NumPy.
+
+    The four pairwise disjointness checks of is_quartet_possible are
+    equivalent to the c-h-s and c-h_-s control path unions being
+    disjoint."""
+    unions = [
+        control_path_unions(path_arrays, c, h, s, max_length) for h in H_
+    ]
+    possible_h = {}
+    if triangle:
+        lengths, masks = path_arrays[(c, s)]
+        possible_h = dict(
+            zip(H_,
+                disjoint_pair_matrix([masks[lengths < max_length]],
+                                     unions)[0]))
+    possible_hh = disjoint_pair_matrix(unions, unions, symmetric=True)
+    possible_hh = {(h, h_): possible_hh[i, j]
+                   for (i, h), (j, h_) in itertools.combinations(
+                       enumerate(H_), 2)}
+    return possible_h, possible_hh
+
+
 # Path-Disjoint covering quartets
-def construct_quartets(C, S, H, all_paths, max_length):
+def construct_quartets(C,
+                       S,
+                       H,
+                       all_paths,
+                       max_length,
+                       vectorized: bool = True,
+                       path_arrays=None):
+    """Construct the path-disjoint quartets (c, h, h_, s).
+
+    With vectorized, the path combinations are tested with NumPy for all
+    (c, h, h_, s) blocks of a controller-switch pair at once, otherwise
+    path by path."""
+    quartets = set(), {}, {}, {}, {}
+
+    if vectorized and path_arrays is None:
+        path_arrays = get_path_arrays(all_paths)
+
+    for c, s in itertools.product(C, S):
+        H_ = list(set(H) - {c, s})
+        triangle = c != s and c in H
+
+        for q in _direct_quartet_bounds(c, s, H, all_paths, max_length):
+            _add_quartet(quartets, q)
+        if vectorized:
+            possible_h, possible_hh = _check_quartets_vectorized(
+                path_arrays, c, s, H_, triangle, max_length)
+        else:
+            possible_h, possible_hh = _check_quartets_loop(
+                all_paths, c, s, H_, triangle, max_length)
+
+        # (c,c,h,s) and (c,h,c,s)
+        for h in H_:
+            if possible_h.get(h):
+                _add_quartet(quartets, (c, c, h, s))
+                _add_quartet(quartets, (c, h, c, s))
+
+        for h, h_ in itertools.combinations(H_, 2):
+            if possible_hh[(h, h_)]:
+                _add_quartet(quartets, (c, h, h_, s))
+
+    return quartets
+
+
+# Arguments shared by the quartet construction workers
+_quartet_worker_kwargs = {}
+
+
+def _init_quartet_worker(kwargs):
+    _quartet_worker_kwargs.update(kwargs)
+
+
+def _construct_quartets_shard(C):
+    return construct_quartets(C=C, **_quartet_worker_kwargs)
+
+
+def process_pool(max_workers, initializer, initargs):
+    """Process pool whose workers run initializer(*initargs) once when they
+    start. The arguments are inherited without pickling where fork is
+    available."""
+    mp_context = (multiprocessing.get_context('fork')
+                  if 'fork' in multiprocessing.get_all_start_methods() else
+                  None)
+    return concurrent.futures.ProcessPoolExecutor(max_workers=max_workers,
+                                                  mp_context=mp_context,
+                                                  initializer=initializer,
+                                                  initargs=initargs)
+
+
+def construct_quartets_parallel(C,
+                                S,
+                                H,
+                                all_paths,
+                                max_length,
+                                workers: int = 2,
+                                vectorized: bool = True):
+    """Construct the path-disjoint quartets in a process pool.
+
+    The controllers are split into contiguous shards, one per worker. The
+    paths are handed to each worker once when it starts and the shard
+    results are merged in controller order, so the result equals that of
+    construct_quartets."""
+    C = list(C)
+    shard_size = -(-len(C) // workers)
+    shards = [C[i:i + shard_size] for i in range(0, len(C), shard_size)]
+
+    worker_kwargs = {
+        'S': S,
+        'H': H,
+        'all_paths': all_paths,
+        'max_length': max_length,
+        'vectorized': vectorized,
+        'path_arrays': (get_path_arrays(all_paths)
+                        if vectorized else None),
+    }
+    with process_pool(len(shards), _init_quartet_worker,
+                      (worker_kwargs, )) as executor:
+        results = list(executor.map(_construct_quartets_shard, shards))
+
     Q = set()
     Qc, Qs = {}, {}
     Qcs = {}
     Qhh = {}
+    for Q_, Qc_, Qs_, Qcs_, Qhh_ in results:
+        Q.update(Q_)
+        Qc.update(Qc_)
+        for s, quartets in Qs_.items():
+            Qs.setdefault(s, []).extend(quartets)
+        for cs, hypervisor_pairs in Qcs_.items():
+            Qcs.setdefault(cs, set()).update(hypervisor_pairs)
+        for hh, cs_pairs in Qhh_.items():
+            Qhh.setdefault(hh, set()).update(cs_pairs)
+
+    return Q, Qc, Qs, Qcs, Qhh
+
 
+def _check_quartet_bounds(path_arrays, c, s, H_, triangle, max_length):
+    """Latency bounds of the (c,c,h,s) and (c,h,h_,s) quartets, the
+    latter as a matrix indexed like H_."""
+    lengths, unions = zip(*[
+        control_path_unions(path_arrays,
+                            c,
+                            h,
+                            s,
+                            max_length,
+                            with_length=True) for h in H_
+    ]) if H_ else ((), ())
+    bounds_h = {}
+    if triangle:
+        ls, ms = path_arrays[(c, s)]
+        short = ls < max_length
+        bounds_h = dict(
+            zip(
+                H_,
+                disjoint_pair_bounds([ms[short]], unions, [ls[short]],
+                                     lengths)[0]))
+    bounds_hh = disjoint_pair_bounds(unions,
+                                     unions,
+                                     lengths,
+                                     lengths,
+                                     symmetric=True)
+    return bounds_h, bounds_hh
+
+
+def construct_quartet_bounds(C,
+                             S,
+                             H,
+                             all_paths,
+                             max_length,
+                             path_arrays=None):
+    """Lowest latency bound of every quartet possible below max_length.
+
+    The bound of a quartet is the smallest max(primary, secondary) control
+    path length over its path-disjoint control paths, so the quartet is
+    possible for every max_length above its bound. The dict is ordered the
+    same way construct_quartets adds the quartets."""
+    if path_arrays is None:
+        path_arrays = get_path_arrays(all_paths)
+
+    bounds = {}
     for c, s in itertools.product(C, S):
-        # (c,c,c,c)
-        if c == s and c in H:
-            q = (c, c, c, c)
-            Q.add(q)
-            Qc.setdefault(c, []).append(q)
-            Qs.setdefault(s, []).append(q)
-            Qcs.setdefault((s, s), set()).add((s, s))
-            Qhh.setdefault((s, s), set()).add((s, s))
-
-        # (c,s,s,s)
-        if (c != s and s in H and all_paths[(c, s)]
-                and all_paths[(c, s)][0]['length'] < max_length):
-            q = (c, s, s, s)
-            Q.add(q)
-            Qc.setdefault(c, []).append(q)
-            Qs.setdefault(s, []).append(q)
-            Qcs.setdefault((c, s), set()).add((s, s))
-            Qhh.setdefault((s, s), set()).add((c, s))
+        H_ = list(set(H) - {c, s})
+        bounds.update(
+            _direct_quartet_bounds(c, s, H, all_paths, max_length))
+        bounds_h, bounds_hh = _check_quartet_bounds(path_arrays, c, s, H_,
+                                                    c != s and c in H,
+                                                    max_length)
 
         # (c,c,h,s) and (c,h,c,s)
-        if c != s and c in H:
-            for h in set(H) - {c, s}:
-                if is_triangle_quartet_possible(all_paths, c, c, h, s,
-                                                max_length):
-                    for q in [(c, c, h, s), (c, h, c, s)]:
-                        Q.add(q)
-                        Qc.setdefault(c, []).append(q)
-                        Qs.setdefault(s, []).append(q)
-                        Qcs.setdefault((c, s), set()).add((min(c,
-                                                               h), max(c, h)))
-                        Qhh.setdefault((min(c, h), max(c, h)), set()).add(
-                            (c, s))
-
-        for h, h_ in itertools.combinations(set(H) - {c, s}, 2):
-            if is_quartet_possible(all_paths, c, h, h_, s, max_length):
-                q = (c, h, h_, s)
-                Q.add(q)
-                Qc.setdefault(c, []).append(q)
-                Qs.setdefault(s, []).append(q)
-                Qcs.setdefault((c, s), set()).add((min(h, h_), max(h, h_)))
-                Qhh.setdefault((min(h, h_), max(h, h_)), set()).add((c, s))
+        for h in H_:
+            if bounds_h.get(h, np.inf) < np.inf:
+                bounds[(c, c, h, s)] = bounds_h[h]
+                bounds[(c, h, c, s)] = bounds_h[h]
 
-    return Q, Qc, Qs, Qcs, Qhh
+        for (i, h), (j, h_) in itertools.combinations(enumerate(H_), 2):
+            if bounds_hh[i, j] < np.inf:
+                bounds[(c, h, h_, s)] = bounds_hh[i, j]
+
+    return bounds
+
+
+def quartets_from_bounds(quartet_bounds, max_length):
+    """Filter the quartets possible below max_length from their bounds.
+
+    Returns the same structures as construct_quartets."""
+    quartets = set(), {}, {}, {}, {}
+    for q, bound in quartet_bounds.items():
+        if bound < max_length:
+            _add_quartet(quartets, q)
+    return quartets
+
+
+def quartet_tensor(Q, n):
+    """Boolean tensor Qfeas[c, h, h_, s] of the quartets of n nodes,
+    symmetric in the hypervisor pair (h, h_)."""
+    Qfeas = np.zeros((n, n, n, n), dtype=bool)
+    if Q:
+        c, h, h_, s = np.array(list(Q)).T
+        Qfeas[c, h, h_, s] = True
+        Qfeas[c, h_, h, s] = True
+    return Qfeas
+
+
+def hypervisor_pair_incidence(Qfeas):
+    """Sparse matrix M[h * n + h_, c * n + s] of the quartet tensor, that is
+    1 if (c, s) can be controlled through the hypervisor pair (h, h_)."""
+    n = Qfeas.shape[0]
+    c, h, h_, s = np.nonzero(Qfeas)
+    return scipy.sparse.csr_matrix(
+        (np.ones(len(c), dtype=np.int32), (h * n + h_, c * n + s)),
+        shape=(n * n, n * n))
 
 
 def quartets_to_triplets(Q):
@@ -236,8 +652,61 @@ def get_allowed_hypervisor_pairs_by_switch(Ts):
     }
 
 
+def coverage_incidence(Tc, n: int = 0):
+    """Sparse matrix M[c, h * n + h_] that is 1 for the triplets (c, h, h_)
+    of Tc. n is raised to cover all nodes of the triplets."""
+    triplets = np.array([t for c in Tc for t in Tc[c]],
+                        dtype=np.int64).reshape(-1, 3)
+    n = max(n, int(np.max(triplets, initial=-1)) + 1)
+    return scipy.sparse.csr_matrix(
+        (np.ones(len(triplets), dtype=np.int32),
+         (triplets[:, 0], triplets[:, 1] * n + triplets[:, 2])),
+        shape=(n, n * n))
+
+
+def covered_customers_batch(Tc,
+                            F_batch,
+                            C,
+                            incidence=None,
+                            chunk_size: int = 2**22) -> np.ndarray:
+    """Boolean matrix covered[b, i] that tells if customer C[i] is covered
+    by the facility set F_batch[b], as in covered_customers.
+
+    The facility pairs of each set are masked in the columns of the
+    coverage incidence matrix, so the sets are scored with sparse products.
+    The masks are built for chunks of sets with about chunk_size entries,
+    so the memory usage does not grow with the number of sets times n^2."""
+    C = list(C)
+    if incidence is None:
+        incidence = coverage_incidence(
+            Tc,
+            max([max(C, default=-1)] +
+                [max(F, default=-1) for F in F_batch]) + 1)
+    n = incidence.shape[0]
+    used = np.zeros((len(F_batch), n), dtype=bool)
+    for b, F in enumerate(F_batch):
+        used[b, list(F)] = True
+
+    incidence = incidence[C]
+    covered = used[:, C]
+    rows = max(1, chunk_size // (n * n))
+    for start in range(0, len(F_batch), rows):
+        chunk = used[start:start + rows]
+        masks = (chunk[:, :, None] & chunk[:, None, :]).reshape(
+            len(chunk), n * n)
+        covered[start:start + rows] |= (
+            incidence @ masks.T.astype(np.int32)).T > 0
+    return covered
+
+
 # Path-Disjoint covered customers by F
-def covered_customers(Tc, F, C):
+def covered_customers(Tc, F, C, incidence=None):
+    if incidence is not None:
+        C = list(C)
+        return [
+            C[i] for i in np.flatnonzero(
+                covered_customers_batch(Tc, [F], C, incidence)[0]).tolist()
+        ]
     covered = []
     for c in C:
         if c in F:
@@ -250,6 +719,138 @@ def covered_customers(Tc, F, C):
     return covered
 
 
+class CoverageEngine:
+    """Customers C covered by the used facilities through the triplets Tc,
+    as in covered_customers, kept up to date when facilities are added or
+    removed.
+
+    A customer that is a facility itself gets the triplet (c, c, c). For
+    every triplet the number of its facilities that are not used is kept,
+    for every customer the number of its satisfied triplets, and for every
+    customer and facility the number of triplets that only miss that
+    facility. The gains of single facilities and the overlap of those gains
+    between facility pairs are updated from the rows of the customers whose
+    triplets change. Facilities outside of F are never used."""
+
+    def __init__(self, C, F, Tc):
+        self.C = list(C)
+        self.F = list(F)
+        self.facility_index = {f: i for i, f in enumerate(self.F)}
+        customer_index = {c: i for i, c in enumerate(self.C)}
+
+        triplets = np.array([(customer_index[c], self.facility_index[f],
+                              self.facility_index[f_]) for c in self.C
+                             for _, f, f_ in Tc.get(c, []) + [(c, c, c)]
+                             if f in self.facility_index
+                             and f_ in self.facility_index],
+                            dtype=np.int64).reshape(-1, 3)
+        self.customers = triplets[:, 0]
+        self.facilities = triplets[:, 1:]
+
+        self.triplets_by_facility = [
+            np.flatnonzero((self.facilities[:, 0] == i)
+                           | (self.facilities[:, 1] == i))
+            for i in range(len(self.F))
+        ]
+
+        self.used = np.zeros(len(self.F), dtype=bool)
+        self.missing = np.where(self.facilities[:, 0] == self.facilities[:, 1],
+                                1, 2)
+        self.satisfied = np.zeros(len(self.C), dtype=np.int64)
+        self.single = np.zeros((len(self.C), len(self.F)), dtype=np.int64)
+        single = self.missing == 1
+        np.add.at(self.single,
+                  (self.customers[single], self.facilities[single, 0]), 1)
+
+        rows = self.get_gain_rows(np.arange(len(self.C)))
+        self.gains = rows.sum(axis=0)
+        self.overlap = rows.T @ rows
+
+    def get_gain_rows(self, customers) -> np.ndarray:
+        """Rows A[c, f] that tell if the uncovered customer c gets covered
+        by using facility f."""
+        return ((self.single[customers] > 0)
+                & (self.satisfied[customers] == 0)[:, None]).astype(np.int64)
+
+    def update(self, i, sign):
+        triplets = self.triplets_by_facility[i]
+        customers = np.unique(self.customers[triplets])
+        old_rows = self.get_gain_rows(customers)
+
+        # Triplets that are completed by i, or opened again without it
+        complete = triplets[self.missing[triplets] == (1 if sign > 0 else 0)]
+        np.add.at(self.satisfied, self.customers[complete], sign)
+        np.add.at(self.single, (self.customers[complete], i), -sign)
+        # Triplets that only miss the other facility with i used
+        a, b = self.facilities[triplets, 0], self.facilities[triplets, 1]
+        half = triplets[(a != b)
+                        & (self.missing[triplets] == (2 if sign > 0 else 1))]
+        other = np.where(self.facilities[half, 0] == i,
+                         self.facilities[half, 1], self.facilities[half, 0])
+        np.add.at(self.single, (self.customers[half], other), sign)
+        self.missing[triplets] -= sign
+
+        new_rows = self.get_gain_rows(customers)
+        self.gains += new_rows.sum(axis=0) - old_rows.sum(axis=0)
+        self.overlap += new_rows.T @ new_rows - old_rows.T @ old_rows
+
+    def add(self, f):
+        i = self.facility_index[f]
+        if self.used[i]:
+            return
+        self.used[i] = True
+        self.update(i, 1)
+
+    def remove(self, f):
+        i = self.facility_index[f]
+        if not self.used[i]:
+            return
+        self.used[i] = False
+        self.update(i, -1)
+
+    def set_facilities(self, F_used):
+        """Use exactly the facilities in F_used."""
+        F_used = set(F_used)
+        for i in np.flatnonzero(self.used).tolist():
+            if self.F[i] not in F_used:
+                self.remove(self.F[i])
+        for f in F_used:
+            self.add(f)
+
+    def get_covered(self) -> np.ndarray:
+        return self.satisfied > 0
+
+    def get_covered_count(self) -> int:
+        return int(np.count_nonzero(self.get_covered()))
+
+    def covered_customers(self) -> list:
+        """The customers covered_customers returns for the used facilities."""
+        return [
+            self.C[i] for i in np.flatnonzero(self.get_covered()).tolist()
+        ]
+
+    def get_gains(self) -> np.ndarray:
+        """Number of customers that get covered by using each facility."""
+        return self.gains.copy()
+
+    def get_pair_gains(self) -> np.ndarray:
+        """Number of customers that get covered by using each pair of
+        facilities f and f_, as a matrix G[f, f_].
+
+        The customers covered by f or f_ alone come from the gains and their
+        overlap. Only the customers that need both facilities of an open
+        triplet are collected from the triplets on each call."""
+        G = self.gains[:, None] + self.gains[None, :] - self.overlap
+        t = (self.missing == 2) & (self.satisfied[self.customers] == 0)
+        c = self.customers[t]
+        a, b = self.facilities[t].min(axis=1), self.facilities[t].max(axis=1)
+        t = (self.single[c, a] == 0) & (self.single[c, b] == 0)
+        n = len(self.F)
+        pairs = np.unique((c[t] * n + a[t]) * n + b[t]) % (n * n)
+        pair_only = np.bincount(pairs, minlength=n * n).reshape(n, n)
+        return G + pair_only + pair_only.T
+
+
 def control_path_length(control_path):
     primary, secondary = 0, 0
     if control_path['pc']:
@@ -0,0 +1,147 @@
+# Standard library imports.
+import os
+from collections.abc import Mapping
+
+# Related third party imports.
+import numpy as np
+
+# Local application/library specific imports.
+
+
+class PathStore(Mapping):
+    """Columnar store of the path records of all node pairs.
+
+    Behaves like the possible_paths dict: (s, t) and (t, s) map to the same
+    list of path records. The paths of the node pair in row r are the
+    entries indptr[r]:indptr[r+1] of lengths and masks, with masks holding
+    the edge bitmask of each path as a row of uint64 words. Bit i of a mask
+    is the directed edge arcs[i]. The records are decoded on first access."""
+
+    array_names = ('pairs', 'indptr', 'lengths', 'masks', 'arcs')
+
+    def __init__(self, pairs, indptr, lengths, masks, arcs, folder=None):
+        self.pairs = pairs
+        self.indptr = indptr
+        self.lengths = lengths
+        self.masks = masks
+        self.arcs = arcs
+        self.folder = None if folder is None else os.path.abspath(folder)
+
+        n = int(np.max(pairs)) + 1 if len(pairs) else 0
+        rows = np.arange(len(pairs))
+        self.pair_row = np.full((n, n), -1, dtype=np.int64)
+        self.pair_row[pairs[:, 0], pairs[:, 1]] = rows
+        self.pair_row[pairs[:, 1], pairs[:, 0]] = rows
+        self._records = {}
+
+    @classmethod
+    def from_paths(cls, all_paths, edge_index):
+        """Pack a possible_paths dict whose masks were built with
+        edge_index."""
+        arcs = np.array(sorted(edge_index, key=edge_index.get),
+                        dtype=np.int64).reshape(-1, 2)
+        n_words = max(1, -(-len(arcs) // 64))
+
+        pairs, indptr, lengths, masks = {}, [0], [], []
+        for (s, t), paths in all_paths.items():
+            if (t, s) in pairs:
+                continue
+            pairs[(s, t)] = None
+            indptr.append(indptr[-1] + len(paths))
+            for p in paths:
+                lengths.append(p['length'])
+                masks.append([(p['mask'] >> (64 * i)) & 0xFFFFFFFFFFFFFFFF
+                              for i in range(n_words)])
+        return cls(pairs=np.array(list(pairs), dtype=np.int64).reshape(-1, 2),
+                   indptr=np.array(indptr, dtype=np.int64),
+                   lengths=np.array(lengths, dtype=float),
+                   masks=np.array(masks, dtype=np.uint64).reshape(
+                       len(lengths), n_words),
+                   arcs=arcs)
+
+    @classmethod
+    def load(cls, folder, mmap_mode='r'):
+        """Load a store saved with save, memory-mapping the arrays."""
+        return cls(**{
+            name: np.load(os.path.join(folder, f"{name}.npy"),
+                          mmap_mode=mmap_mode)
+            for name in cls.array_names
+        },
+                   folder=folder)
+
+    def save(self, folder):
+        """Save the arrays as .npy files in folder.
+
+        The store then pickles as a reference to the absolute path of
+        folder, so it loads from any working directory."""
+        os.makedirs(folder, exist_ok=True)
+        for name in self.array_names:
+            np.save(os.path.join(folder, f"{name}.npy"), getattr(self, name))
+        self.folder = os.path.abspath(folder)
+
+    def __reduce__(self):
+        if self.folder is not None:
+            return (PathStore.load, (self.folder, ))
+        return (PathStore,
+                tuple(getattr(self, name) for name in self.array_names))
+
+    def get_row(self, key):
+        s, t = key
+        if not (0 <= s < len(self.pair_row) and 0 <= t < len(self.pair_row)):
+            raise KeyError(key)
+        row = self.pair_row[s, t]
+        if row < 0:
+            raise KeyError(key)
+        return row
+
+    def __getitem__(self, key):
+        row = self.get_row(key)
+        if row not in self._records:
+            self._records[row] = self.decode(row)
+        return self._records[row]
+
+    def count(self, key):
+        """Number of paths of a node pair, without decoding them."""
+        row = self.get_row(key)
+        return int(self.indptr[row + 1] - self.indptr[row])
+
+    def decode(self, row):
+        """Path records of the node pair in row."""
+        start, stop = self.indptr[row], self.indptr[row + 1]
+        masks = np.ascontiguousarray(self.masks[start:stop], dtype='<u8')
+        bits = np.unpackbits(masks.view(np.uint8), axis=1, bitorder='little')
+        return [{
+            'length': float(length),
+            'path': set(
+                map(tuple, self.arcs[np.flatnonzero(path_bits)].tolist())),
+            'mask': int.from_bytes(words.tobytes(), 'little')
+        } for length, words, path_bits in zip(self.lengths[start:stop], masks,
+                                              bits)]
+
+    def __iter__(self):
+        for s, t in self.pairs.tolist():
+            yield (s, t)
+            yield (t, s)
+
+    def __len__(self):
+        return 2 * len(self.pairs)
+
+    def path_arrays(self):
+        """The dict (u, v) -> (lengths, masks) of get_path_arrays,
+        as views of the stored arrays."""
+        path_arrays = {}
+        for row, (s, t) in enumerate(self.pairs.tolist()):
+            start, stop = self.indptr[row], self.indptr[row + 1]
+            path_arrays[(s, t)] = path_arrays[(t, s)] = (
+                self.lengths[start:stop], self.masks[start:stop])
+        return path_arrays
+
+    def filter(self, max_length):
+        """New store with the paths shorter than max_length."""
+        keep = np.asarray(self.lengths) < max_length
+        kept = np.concatenate(([0], np.cumsum(keep)))
+        return PathStore(pairs=np.asarray(self.pairs),
+                         indptr=kept[self.indptr],
+                         lengths=np.asarray(self.lengths)[keep],
+                         masks=np.asarray(self.masks)[keep],
+                         arcs=np.asarray(self.arcs))
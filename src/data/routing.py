@@ -1,5 +1,6 @@
 # Standard library imports.
 import itertools
+import heapq
 
 # Related third party imports.
 import numpy as np
@@ -7,9 +8,11 @@ import networkx as nx
 import copy
 
 # Local application/library specific imports.
+from src.data.path_store import PathStore
 
 # path: set of tuples
 # paths: list of path
+# path record: {'length': float, 'path': path, 'mask': int}
 
 
 def is_disjoint(p, q):
@@ -27,6 +30,31 @@ def is_disjoint(p, q):
         return p_.isdisjoint(q_)
 
 
+def is_disjoint_mask(p, q):
+    """Check if 2 path records are link disjoint using their edge bitmasks."""
+    return bool(p['mask']) and bool(q['mask']) and not p['mask'] & q['mask']
+
+
+def get_edge_index(G):
+    """Assign a bit position to every directed edge of G.
+
+    Paths are stored as sets of directed edge tuples, so (u, v) and (v, u)
+    get separate bits to keep the semantics of is_disjoint."""
+    edge_index = {}
+    for u, v in G.edges:
+        edge_index.setdefault((u, v), len(edge_index))
+        edge_index.setdefault((v, u), len(edge_index))
+    return edge_index
+
+
+def path_as_bitmask(p, edge_index):
+    """Convert a set of edges to an integer with one bit per edge."""
+    mask = 0
+    for e in p:
+        mask |= 1 << edge_index[e]
+    return mask
+
+
 def path_as_edges(path):
     """Convert list of nodes to list of edges connecting them."""
     if all(isinstance(x, int) for x in path):
@@ -54,31 +82,252 @@ def get_paths(G,
               max_length: float = np.inf,
               shortest_k: int = 16,
               with_length: bool = False,
+              edge_index: dict = None,
+              bounded: bool = True,
+              with_limit: bool = False,
               **kwargs):
-    """Get the k shortest paths between u and v with lower length than max_length"""
-    shortest_k_path = k_shortest_paths(G, u, v, shortest_k)
+    """Get the k shortest paths between u and v with lower length than
+    max_length
+
+    With with_length the paths are returned as path records that also hold
+    the edge bitmask used by is_disjoint_mask.
+
+    The paths are generated in increasing length, so with bounded the
+    generation stops at the first path over max_length instead of
+    generating all k paths. With with_limit the limit that ended the
+    generation is returned too: 'k', 'length' or None if there are no
+    more paths."""
+    if with_length and edge_index is None:
+        edge_index = get_edge_index(G)
+    if bounded:
+        shortest_k_path = nx.shortest_simple_paths(G, u, v, weight="length")
+    else:
+        shortest_k_path = k_shortest_paths(G, u, v, shortest_k)
     paths = []
+    limit = None
     for path in shortest_k_path:
         p = path_as_edges(path)
         l = latency_of_path(G, p)
         if l < max_length:
             if with_length:
-                paths.append({'length': l, 'path': p})
+                paths.append({
+                    'length': l,
+                    'path': p,
+                    'mask': path_as_bitmask(p, edge_index)
+                })
             else:
                 paths.append(p)
+        elif bounded:
+            limit = 'length'
+            break
+        if bounded and len(paths) == shortest_k:
+            limit = 'k'
+            break
+    if with_limit:
+        return paths, limit
     return paths
 
 
-def get_all_paths(G, **kwargs):
-    """Get all simple paths between nodes"""
+def get_all_paths(G,
+                  batched: bool = True,
+                  path_limits: dict = None,
+                  **kwargs):
+    """Get all simple paths between nodes
+
+    If a path_limits dict is given, it is filled with the limit that ended
+    the path generation of each node pair ('k', 'length' or None). The
+    batched engine reports 'length' whenever its search was pruned at
+    max_length, also if the pruned part holds no further path."""
+    if path_limits is None:
+        path_limits = {}
+    if batched:
+        return get_all_paths_batched(G, path_limits=path_limits, **kwargs)
     all_paths = {}
+    edge_index = get_edge_index(G)
     for s, t in itertools.combinations(G.nodes, 2):
-        paths = get_paths(G=G, u=s, v=t, with_length=True, **kwargs)
+        paths, limit = get_paths(G=G,
+                                 u=s,
+                                 v=t,
+                                 with_length=True,
+                                 edge_index=edge_index,
+                                 with_limit=True,
+                                 **kwargs)
         all_paths[(s, t)] = paths
         all_paths[(t, s)] = paths
+        path_limits[(s, t)] = limit
+        path_limits[(t, s)] = limit
+    return all_paths
+
+
+def _spur_path(adj, u, v, root_length, max_length, removed_nodes,
+               removed_edges, weight):
+    """Dijkstra from u to v avoiding the removed nodes and edges.
+
+    Returns (length, node list, cut) of a path for which root_length plus
+    its length is below max_length, with length and node list set to None
+    if there is no such path. cut tells if the search dropped a node
+    because of max_length."""
+    dist = {u: 0}
+    prev = {u: None}
+    heap = [(0, u)]
+    done = set()
+    cut = False
+    while heap:
+        d, x = heapq.heappop(heap)
+        if x in done:
+            continue
+        if x == v:
+            path = [v]
+            while prev[path[-1]] is not None:
+                path.append(prev[path[-1]])
+            return d, path[::-1], cut
+        done.add(x)
+        for y, attr in adj[x].items():
+            if (y in removed_nodes or y in done or (x, y) in removed_edges):
+                continue
+            d_ = d + attr[weight]
+            if root_length + d_ >= max_length:
+                cut = True
+            elif d_ < dist.get(y, np.inf):
+                dist[y] = d_
+                prev[y] = x
+                heapq.heappush(heap, (d_, y))
+    return None, None, cut
+
+
+def _spur_paths(adj, A, v, distance_to_v, max_length, weight):
+    """Yen's spur paths below max_length that deviate from the last path
+    of A.
+
+    Returns the (length, node list) pairs and whether a spur search was
+    cut at max_length."""
+    _, prev_path = A[-1]
+    spur_paths = []
+    cut = False
+    root_length = 0
+    for i in range(len(prev_path) - 1):
+        spur_node = prev_path[i]
+        root = prev_path[:i + 1]
+        if i > 0:
+            root_length += adj[prev_path[i - 1]][spur_node][weight]
+        if root_length + distance_to_v.get(spur_node, np.inf) >= max_length:
+            cut = True
+            continue
+
+        removed_edges = {(path[i], path[i + 1])
+                         for _, path in A
+                         if path[:i + 1] == root and len(path) > i + 1}
+        spur_length, spur_path, spur_cut = _spur_path(adj, spur_node, v,
+                                                      root_length,
+                                                      max_length,
+                                                      set(root[:-1]),
+                                                      removed_edges, weight)
+        cut = cut or spur_cut
+        if spur_path is not None:
+            spur_paths.append(
+                (root_length + spur_length, root[:-1] + spur_path))
+    return spur_paths, cut
+
+
+def k_shortest_paths_bounded(G,
+                             u,
+                             v,
+                             k,
+                             first_path,
+                             distance_to_v,
+                             max_length: float = np.inf,
+                             weight="length"):
+    """Yen's k shortest loopless paths between u and v below max_length.
+
+    first_path is the shortest (length, node list) pair, taken from the
+    shortest-path tree of u, and distance_to_v maps every node to its
+    shortest distance to v. A spur search is skipped when its root length
+    plus that distance already reaches max_length, and every spur search
+    stops at max_length, so no path over the bound is generated.
+
+    Returns the (length, node list) pairs in increasing length and the
+    limit that ended the search: 'k', 'length' or None."""
+    A = [first_path]
+    B = []
+    seen = {tuple(first_path[1])}
+    cut = False
+    while len(A) < k:
+        spur_paths, spur_cut = _spur_paths(G.adj, A, v, distance_to_v,
+                                           max_length, weight)
+        cut = cut or spur_cut
+        for length, path in spur_paths:
+            if tuple(path) not in seen:
+                seen.add(tuple(path))
+                heapq.heappush(B, (length, path))
+        if not B:
+            break
+        A.append(heapq.heappop(B))
+
+    if len(A) == k:
+        return A, 'k'
+    return A, 'length' if cut else None
+
+
+def get_all_paths_batched(G,
+                          max_length: float = np.inf,
+                          shortest_k: int = 16,
+                          weight="length",
+                          path_limits: dict = None,
+                          **kwargs):
+    """Get the k shortest paths below max_length between all node pairs.
+
+    Same result as get_paths for every pair, but the shortest-path tree of
+    each source and the distances to each target are computed once and
+    shared by all pairs, and the search is pruned at max_length."""
+    if path_limits is None:
+        path_limits = {}
+    distances = dict(nx.all_pairs_dijkstra_path_length(G, weight=weight))
+    edge_index = get_edge_index(G)
+    nodes = list(G.nodes)
+
+    all_paths = {}
+    for i, s in enumerate(nodes):
+        first_lengths, first_paths = nx.single_source_dijkstra(
+            G, s, cutoff=max_length, weight=weight)
+        for t in nodes[i + 1:]:
+            paths = []
+            if t in first_paths and first_lengths[t] < max_length:
+                shortest_paths, limit = k_shortest_paths_bounded(
+                    G, s, t, shortest_k, (first_lengths[t], first_paths[t]),
+                    distances[t], max_length, weight)
+                for length, path in shortest_paths:
+                    p = path_as_edges(path)
+                    paths.append({
+                        'length': length,
+                        'path': p,
+                        'mask': path_as_bitmask(p, edge_index)
+                    })
+            else:
+                limit = 'length' if t in distances[s] else None
+            all_paths[(s, t)] = paths
+            all_paths[(t, s)] = paths
+            path_limits[(s, t)] = limit
+            path_limits[(t, s)] = limit
     return all_paths
 
 
+def filter_paths(all_paths, max_length):
+    """Keep the paths shorter than max_length for every node pair.
+
+    The k shortest paths of a pair do not depend on max_length, so this
+    equals get_all_paths with the lower max_length."""
+    if isinstance(all_paths, PathStore):
+        return all_paths.filter(max_length)
+    filtered_paths, filtered = {}, {}
+    for key, paths in all_paths.items():
+        if id(paths) not in filtered:
+            filtered[id(paths)] = [
+                p for p in paths if p['length'] < max_length
+            ]
+        filtered_paths[key] = filtered[id(paths)]
+    return filtered_paths
+
+
 def get_shortest_paths(G, u, v):
     """Get all shortest paths between u and v"""
     return list(
@@ -102,8 +351,7 @@ def triangle_control_path(all_paths, c, h, h_, s, max_length):
 
     best_control_path = {}
     for qc, ps, qs in itertools.product(Qc, Ps, Qs):
-        if (is_disjoint(ps['path'], qs['path'])
-                and is_disjoint(qc['path'], ps['path'])
+        if (not ps['mask'] & qs['mask'] and not qc['mask'] & ps['mask']
                 and ps['length'] < max_length
                 and qc['length'] + qs['length'] < max_length):
             if not best_control_path:
@@ -147,10 +395,10 @@ def diamond_control_path(all_paths, c, h, h_, s, max_length):
     for pc, qc, ps, qs in itertools.product(Pc, Qc, Ps, Qs):
         if (pc['length'] + ps['length'] < max_length
                 and qc['length'] + qs['length'] < max_length
-                and is_disjoint(pc['path'], qc['path'])
-                and is_disjoint(ps['path'], qs['path'])
-                and is_disjoint(pc['path'], qs['path'])
-                and is_disjoint(qc['path'], ps['path'])):
+                and not pc['mask'] & qc['mask']
+                and not ps['mask'] & qs['mask']
+                and not pc['mask'] & qs['mask']
+                and not qc['mask'] & ps['mask']):
             if not best_control_path:
                 best_control_path['pc'] = pc
                 best_control_path['ps'] = ps
@@ -207,7 +455,7 @@ def get_best_disjoint_path_pair(P, Q):
     """Find best disjoint path pair"""
     p_, q_ = {'path': None, 'length': np.inf}, {'path': None, 'length': np.inf}
     for p, q in itertools.product(P, Q):
-        if is_disjoint(p['path'], q['path']) and is_better_path_pair(
+        if is_disjoint_mask(p, q) and is_better_path_pair(
                 p_, q_, p, q):
             p_, q_ = copy.deepcopy(p), copy.deepcopy(q)
 
@@ -30,6 +30,7 @@ hp_settings = {
     'basic': ('ilp', 'acceptance ratio'),
     'conservative': ('ilp', 'acceptance ratio'),
     'liberal': ('ilp', 'acceptance ratio'),
+    'poisson': ('ilp', 'acceptance ratio'),
 }
 dynamic_type = 'basic'
 hp_type, hp_objective = hp_settings[dynamic_type]
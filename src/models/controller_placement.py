@@ -10,10 +10,13 @@ algo = lambda f: algorithms.setdefault(f.__name__, f)
 
 
 @algo
-def random_controller(network_operator, vSDN_request):
+def random_controller(network_operator,
+                      vSDN_request,
+                      possible_controllers_: set = None):
     # print("Random controller placement...")
-    possible_controllers_ = find_possible_controllers(network_operator,
-                                                      vSDN_request)
+    if possible_controllers_ is None:
+        possible_controllers_ = find_possible_controllers(
+            network_operator, vSDN_request)
     if possible_controllers_:
         if vSDN_request.get_controller() in possible_controllers_:
             return vSDN_request.get_controller()
@@ -26,10 +29,13 @@ def random_controller(network_operator, vSDN_request):
 
 
 @algo
-def max_total_hpair(network_operator, vSDN_request):
+def max_total_hpair(network_operator,
+                    vSDN_request,
+                    possible_controllers_: set = None):
     # print("Hpair maximized controller placement...")
-    possible_controllers_ = find_possible_controllers(network_operator,
-                                                      vSDN_request)
+    if possible_controllers_ is None:
+        possible_controllers_ = find_possible_controllers(
+            network_operator, vSDN_request)
 
     if possible_controllers_:
         if vSDN_request.get_controller() in possible_controllers_:
@@ -50,17 +56,17 @@ def max_total_hpair(network_operator, vSDN_request):
 
 
 def find_possible_controllers(network_operator, vSDN_request):
+    masks = network_operator.get_switch_controller_masks()
+    mask = -1
+    for s in vSDN_request.get_switches():
+        mask &= masks[s]
+    if not mask:
+        return set()
+
+    controller_sets = network_operator.get_switch_controller_sets()
     possible_controllers_ = set(network_operator.possible_controllers)
     for s in vSDN_request.get_switches():
-        # print(s, possible_controllers_)
-        h, h_ = network_operator.hypervisor_assignment[s]
-        possible_controllers_for_switch = set()
-        for c in network_operator.possible_controllers:
-            if (((c, h, h_, s) in network_operator.quartets_by_controllers[c])
-                    or ((c, h_, h,
-                         s) in network_operator.quartets_by_controllers[c])):
-                possible_controllers_for_switch.add(c)
-        possible_controllers_ &= possible_controllers_for_switch
+        possible_controllers_ &= controller_sets[s]
     return possible_controllers_
 
 
@@ -8,6 +8,7 @@ import logging
 
 # Related third party imports.
 import numpy as np
+import scipy.sparse
 
 # Local application/library specific imports.
 import src.data.graph_utilities as gu
@@ -22,14 +23,22 @@ heuristic = lambda f: heuristics.setdefault(f.__name__, f)
 
 # Get facility with maximal covering possibility
 # Choosing random at a tie
-def get_facility_for_maxcover(C, C_covered, F, F_used, Tc):
+def get_facility_for_maxcover(C, C_covered, F, F_used, Tc, engine=None):
     currently_covering = len(C_covered)
     F_notused = list(set(F) - set(F_used))
 
-    covering = [
-        len(gu.covered_customers(Tc,
-                                 list(F_used) + [f], C)) for f in F_notused
-    ]
+    if engine is not None:
+        engine.set_facilities(F_used)
+        covered_count = engine.get_covered_count()
+        gains = engine.get_gains()
+        covering = [
+            covered_count + int(gains[engine.facility_index[f]])
+            for f in F_notused
+        ]
+    else:
+        covering = gu.covered_customers_batch(
+            Tc, [list(F_used) + [f] for f in F_notused],
+            C).sum(axis=1).tolist()
     max_covering = max(covering)
     max_indexes = [
         idx for idx, value in enumerate(covering) if value == max_covering
@@ -42,15 +51,23 @@ def get_facility_for_maxcover(C, C_covered, F, F_used, Tc):
 
 # Get facility-pair with maximal covering possibility
 # Choosing random at a tie
-def get_facility_pair_for_maxcover(C, C_covered, F, F_used, Tc):
+def get_facility_pair_for_maxcover(C, C_covered, F, F_used, Tc, engine=None):
     currently_covering = len(C_covered)
     F_notused = list(itertools.combinations(list(set(F) - set(F_used)), 2))
 
-    covering = [
-        len(gu.covered_customers(Tc,
-                                 list(F_used) + [f, f_], C))
-        for f, f_ in F_notused
-    ]
+    if engine is not None:
+        engine.set_facilities(F_used)
+        covered_count = engine.get_covered_count()
+        gains = engine.get_pair_gains()
+        covering = [
+            covered_count + int(gains[engine.facility_index[f],
+                                      engine.facility_index[f_]])
+            for f, f_ in F_notused
+        ]
+    else:
+        covering = gu.covered_customers_batch(
+            Tc, [list(F_used) + [f, f_] for f, f_ in F_notused],
+            C).sum(axis=1).tolist()
     max_covering = max(covering)
     max_indexes = [
         idx for idx, value in enumerate(covering) if value == max_covering
@@ -63,8 +80,17 @@ def get_facility_pair_for_maxcover(C, C_covered, F, F_used, Tc):
 
 
 # Removing unnecessary facilities
-def minimize_cover(C, C_covered, F_used, Tc):
+def minimize_cover(C, C_covered, F_used, Tc, engine=None):
     F_min = deepcopy(F_used)
+    if engine is not None:
+        engine.set_facilities(F_used)
+        for f in F_used:
+            engine.remove(f)
+            if engine.get_covered_count() == len(C_covered):
+                F_min.discard(f)
+            else:
+                engine.add(f)
+        return F_min
     for f in F_used:
         if len(gu.covered_customers(Tc, F_min - set([f]),
                                     C)) == len(C_covered):
@@ -99,19 +125,23 @@ def greedy_max_cover(network_operator=None,
     else:
         k = len(C)
 
+    # Coverage counts are updated incrementally instead of calling
+    # covered_customers for every candidate
+    engine = gu.CoverageEngine(C, F, Tc)
     F_ = set()
     C_ = set()
 
     if start_with_pair:
-        F_.update(get_facility_pair_for_maxcover(C, C_, F, F_, Tc))
+        F_.update(get_facility_pair_for_maxcover(C, C_, F, F_, Tc, engine))
 
     while len(F_) < n_hypervisors and C != C_:
         if end_with_pair and len(F_) == n_hypervisors - 2:
-            F_.update(get_facility_pair_for_maxcover(C, C_, F, F_, Tc))
+            F_.update(get_facility_pair_for_maxcover(C, C_, F, F_, Tc, engine))
         else:
-            F_.update(get_facility_for_maxcover(C, C_, F, F_, Tc))
-            C_ = gu.covered_customers(Tc, F_, C)
-            F_ = minimize_cover(C, C_, F_, Tc)
+            F_.update(get_facility_for_maxcover(C, C_, F, F_, Tc, engine))
+            engine.set_facilities(F_)
+            C_ = engine.covered_customers()
+            F_ = minimize_cover(C, C_, F_, Tc, engine)
     return {
         'active_hypervisors': F_,
     }
@@ -288,25 +318,32 @@ def hp_overall_coverage(network_operator=None,
     return result
 
 
-def get_hypervisor_additional_switch_coverage(S, S_covered, H, H_used, Ts):
+def get_hypervisor_additional_switch_coverage(S,
+                                              S_covered,
+                                              H,
+                                              H_used,
+                                              Ts,
+                                              incidence=None):
     """Returns the additional switch coverage of each unused hypervisor."""
     H_notused = list(set(H) - set(H_used))
 
     if not H_used:
         # if no hypervisor is used, the additional switch coverage is
         # for all hypervisor pairs
+        covered = gu.covered_customers_batch(
+            Ts, [[h, h_] for h in H_notused for h_ in H_notused], S,
+            incidence).reshape(len(H_notused), len(H_notused), len(S))
         return {
-            h: len(set().union(*[
-                set(gu.covered_customers(Ts, [h, h_], S)) for h_ in H_notused
-            ]))
-            for h in H_notused
+            h: int(count)
+            for h, count in zip(H_notused,
+                                covered.any(axis=1).sum(axis=1))
         }
     else:
+        covered = gu.covered_customers_batch(
+            Ts, [list(H_used) + [h] for h in H_notused], S, incidence)
         return {
-            h:
-            len(gu.covered_customers(Ts,
-                                     list(H_used) + [h], S)) - len(S_covered)
-            for h in H_notused
+            h: int(count) - len(S_covered)
+            for h, count in zip(H_notused, covered.sum(axis=1))
         }
 
 
@@ -332,8 +369,88 @@ def get_hypervisor_additional_controller_switch_coverage(H, H_used, Qhh):
         }
 
 
-def get_hypervisor_additional_request_coverage(S, C, H, H_used, Qhh, Qcs, R):
-    """Returns the additional request cs coverage of a hypervisor."""
+class RequestCoverage:
+    """Request controller-switch coverage of hypervisor sets.
+
+    W[c, s] counts the requests that contain switch s and whose switches
+    can all be controlled by controller c. Row h * n + h_ of the pair
+    incidence holds the controller-switch pairs c * n + s of the hypervisor
+    pair (h, h_), and CS_current the pairs of the used hypervisors."""
+
+    def __init__(self, S, C, Qcs, R, pair_incidence):
+        n = self.n = int(round(np.sqrt(pair_incidence.shape[0])))
+        self.pair_incidence = pair_incidence
+
+        # RS: True if a switch is used by a request
+        RS = np.zeros((len(R), n), dtype=bool)
+        for r_idx, request in enumerate(R):
+            RS[r_idx, list(request.get_switches())] = True
+
+        # CS_possible: True if a controller-switch pair is possible
+        CS_possible = np.zeros((n, n), dtype=bool)
+        for c in C:
+            for s in S:
+                if len(Qcs.get((c, s), [])):
+                    CS_possible[c, s] = True
+
+        # C_mask: controllers able to control all switches in a request
+        C_mask = (RS.astype(np.int64) @ CS_possible.T.astype(np.int64)
+                  ) == RS.sum(axis=1)[:, np.newaxis]
+        self.W = (C_mask.T.astype(np.int64) @ RS.astype(np.int64)
+                  ) * CS_possible
+        self.CS_current = np.zeros(n * n, dtype=bool)
+
+    def get_pair_rows(self, H_new, H_used):
+        """Sparse matrix that selects for each hypervisor h of H_new the
+        rows of the hypervisor pairs of h with h and with H_used."""
+        rows = [[h * self.n + h_ for h_ in [h] + list(H_used)] for h in H_new]
+        return scipy.sparse.csr_matrix(
+            (np.ones(sum(map(len, rows)), dtype=np.int32),
+             list(itertools.chain.from_iterable(rows)),
+             np.cumsum([0] + list(map(len, rows)))),
+            shape=(len(H_new), self.n * self.n))
+
+    def set_used(self, H_used):
+        self.CS_current = np.asarray(
+            self.pair_incidence[[
+                h * self.n + h_ for h, h_ in itertools.product(H_used, H_used)
+            ]].sum(axis=0)).ravel() > 0
+
+    def add(self, h, H_used):
+        """Add the controller-switch pairs that h brings to H_used."""
+        self.CS_current |= np.asarray(
+            (self.get_pair_rows([h], H_used) @ self.pair_incidence).sum(
+                axis=0)).ravel() > 0
+
+    def get_additional_coverage(self, H_notused, H_used) -> np.ndarray:
+        """Weight of the controller-switch pairs that each unused hypervisor
+        adds to H_used, computed for all of them with one sparse product."""
+        CS_new = self.get_pair_rows(H_notused, H_used) @ self.pair_incidence
+        CS_new.data[:] = 1
+        return CS_new @ (self.W.ravel() * ~self.CS_current)
+
+
+def get_hypervisor_pair_incidence(S, C, H, Qhh):
+    """Pair incidence of RequestCoverage built from the controller-switch
+    pairs Qhh of each hypervisor pair."""
+    n = max(max(S), max(C), max(H)) + 1
+    return gu.hypervisor_pair_incidence(
+        gu.quartet_tensor([(c, h, h_, s) for (h, h_), cs_pairs in Qhh.items()
+                           for c, s in cs_pairs], n))
+
+
+def get_hypervisor_additional_request_coverage(S,
+                                               C,
+                                               H,
+                                               H_used,
+                                               Qhh,
+                                               Qcs,
+                                               R,
+                                               request_coverage=None):
+    """Returns the additional request cs coverage of a hypervisor.
+
+    request_coverage is a RequestCoverage of R whose CS_current belongs to
+    H_used. It is built from Qhh if not given."""
     H_notused = list(set(H) - set(H_used))
 
     if not H_used:
@@ -341,51 +458,14 @@ def get_hypervisor_additional_request_coverage(S, C, H, H_used, Qhh, Qcs, R):
     elif R is None:
         return {h: 0 for h in H_notused}
 
-    # RS_mask: masks out switches that are not used by a request
-    # True if a switch is used by a request
-    RS_mask = np.zeros((len(R), len(C), len(S)), dtype=bool)
-    for r_idx, request in enumerate(R):
-        for s in request.get_switches():
-            RS_mask[r_idx, :, S.index(s)] = True
-
-    # RCS_mask: masks out controller-switch pairs that can be used by a request
-    # True if a controller-switch pair is possible
-    RCS_mask = np.zeros((len(R), len(C), len(S)), dtype=bool)
-    for c_idx, c in enumerate(C):
-        for s in S:
-            if len(Qcs.get((c, s), [])):
-                RCS_mask[:, c_idx, S.index(s)] = True
-
-    # C_mask: masks out controllers unable to control all switches in a request
-    C_mask = np.sum(np.logical_and(RCS_mask, RS_mask),
-                    axis=2) == np.sum(RS_mask, axis=2)
-    # Removes controllers unable to control all switches in a request
-    RCS_mask = np.logical_and(
-        RCS_mask,
-        np.logical_and(
-            RS_mask, np.concatenate([C_mask[:, :, np.newaxis]] * len(S),
-                                    axis=2)))
-
-    # CS_current: already possible controller-switch pairs
-    CS_current = np.zeros((len(C), len(S)), dtype=bool)
-    for h, h_ in itertools.product(H_used, H_used):
-        for c, s in Qhh.get((h, h_), []):
-            CS_current[C.index(c), S.index(s)] = True
-
-    # For each unused hypervisor, compute the additional controller-switch
-    # pairs that can be used
-    additional_coverage = {h: 0 for h in H_notused}
-    for h in H_notused:
-        CS_new = np.zeros((len(C), len(S)), dtype=bool)
-        for h1, h2 in itertools.product([h] + list(H_used),
-                                        [h] + list(H_used)):
-            for c, s in Qhh.get((h1, h2), []):
-                CS_new[C.index(c), S.index(s)] = True
-
-        additional_coverage[h] = (np.sum(np.logical_and(CS_new, RCS_mask)) -
-                                  np.sum(np.logical_and(CS_current, RCS_mask)))
-
-    return additional_coverage
+    if request_coverage is None:
+        request_coverage = RequestCoverage(
+            S, C, Qcs, R, get_hypervisor_pair_incidence(S, C, H, Qhh))
+        request_coverage.set_used(H_used)
+
+    return dict(
+        zip(H_notused,
+            request_coverage.get_additional_coverage(H_notused, H_used)))
 
 
 def normalize_hypervisor_additional_coverage(additional_coverage):
@@ -411,8 +491,12 @@ def hp_combined_S_CS(network_operator=None,
                      Ts=None,
                      n_hypervisors=None,
                      heuristic_randomness=0.2,
+                     abandon_above: int = None,
                      **kwargs):
-    """Greedy algorithm for the combined switch and controller placement problem."""
+    """Greedy algorithm for the combined switch and controller placement
+    problem.
+
+    Returns None as soon as more than abandon_above hypervisors are used."""
 
     if network_operator is not None and (S is None or H is None or Qhh is None
                                          or Ts is None):
@@ -424,6 +508,16 @@ def hp_combined_S_CS(network_operator=None,
         Qhh = network_operator.quartets_by_hh
 
     R = kwargs.get('vSDN_requests', None)
+    if network_operator is not None:
+        incidence = network_operator.get_coverage_incidence()
+        pair_incidence = network_operator.get_hypervisor_pair_incidence()
+    else:
+        incidence = gu.coverage_incidence(Ts, max(max(S), max(H)) + 1)
+        pair_incidence = get_hypervisor_pair_incidence(S, C, H, Qhh)
+    # The request masks are built once, the covered controller-switch
+    # pairs are updated with each added hypervisor
+    request_coverage = (RequestCoverage(S, C, Qcs, R, pair_incidence)
+                        if R is not None else None)
 
     if n_hypervisors is None or n_hypervisors < 2 or (H is not None and
                                                       n_hypervisors > len(H)):
@@ -433,11 +527,11 @@ def hp_combined_S_CS(network_operator=None,
     S_covered = set()
     H_used = set()
     hypervisor_additional_switch_coverage = get_hypervisor_additional_switch_coverage(
-        S, S_covered, H, H_used, Ts)
+        S, S_covered, H, H_used, Ts, incidence)
     hypervisor_additional_controller_switch_coverage = get_hypervisor_additional_controller_switch_coverage(
         H, H_used, Qhh)
     hypervisor_additional_request_coverage = get_hypervisor_additional_request_coverage(
-        S, C, H, H_used, Qhh, Qcs, R)
+        S, C, H, H_used, Qhh, Qcs, R, request_coverage)
 
     # Main loop
     while len(H_used) < n_hypervisors and len(S_covered) < len(S):
@@ -469,17 +563,21 @@ def hp_combined_S_CS(network_operator=None,
 
         h = max(combined_additional_coverage,
                 key=combined_additional_coverage.get)
+        if request_coverage is not None:
+            request_coverage.add(h, H_used)
         H_used.add(h)
-        S_covered.update(gu.covered_customers(Ts, H_used, S))
+        if abandon_above is not None and len(H_used) > abandon_above:
+            return None
+        S_covered.update(gu.covered_customers(Ts, H_used, S, incidence))
         logging.debug("H_used: %s", H_used)
 
         # Update additional switch coverage
         hypervisor_additional_switch_coverage = get_hypervisor_additional_switch_coverage(
-            S, S_covered, H, H_used, Ts)
+            S, S_covered, H, H_used, Ts, incidence)
         hypervisor_additional_controller_switch_coverage = get_hypervisor_additional_controller_switch_coverage(
             H, H_used, Qhh)
         hypervisor_additional_request_coverage = get_hypervisor_additional_request_coverage(
-            S, C, H, H_used, Qhh, Qcs, R)
+            S, C, H, H_used, Qhh, Qcs, R, request_coverage)
 
     return {
         'active_hypervisors': H_used,
@@ -487,12 +585,168 @@ def hp_combined_S_CS(network_operator=None,
     }
 
 
+_repeat_worker_kwargs = {}
+
+
+def _init_repeat_worker(heuristic_name, kwargs):
+    _repeat_worker_kwargs.update(kwargs, heuristic_name=heuristic_name)
+
+
+def _seed_repetition(seed_sequence):
+    random_seed, np_seed = seed_sequence.generate_state(2)
+    random.seed(int(random_seed))
+    np.random.seed(int(np_seed))
+
+
+def _run_heuristic_repetition(seed_sequence):
+    _seed_repetition(seed_sequence)
+    kwargs = dict(_repeat_worker_kwargs)
+    return heuristics[kwargs.pop('heuristic_name')](**kwargs)
+
+
+class SolutionPool:
+    """Unique solutions with the fewest hypervisors drawn so far.
+
+    The pool is full after patience draws in a row without a new unique
+    minimal solution, or once it holds pool_size solutions. Abandoned
+    draws (None) count as draws without a new solution."""
+
+    def __init__(self, patience: int = None, pool_size: int = None):
+        self.patience = patience
+        self.pool_size = pool_size
+        self.min_h_count = None
+        self.solutions = {}
+        self.draws = 0
+        self.stale_draws = 0
+
+    def add(self, solution) -> None:
+        self.draws += 1
+        if solution is None:
+            self.stale_draws += 1
+            return
+        key = frozenset(solution['active_hypervisors'])
+        if self.min_h_count is None or len(key) < self.min_h_count:
+            self.min_h_count = len(key)
+            self.solutions = {key: solution}
+            self.stale_draws = 0
+        elif len(key) == self.min_h_count and key not in self.solutions:
+            self.solutions[key] = solution
+            self.stale_draws = 0
+        else:
+            if len(key) == self.min_h_count:
+                self.solutions[key] = solution
+            self.stale_draws += 1
+
+    def is_full(self) -> bool:
+        return ((self.patience is not None
+                 and self.stale_draws >= self.patience)
+                or (self.pool_size is not None
+                    and len(self.solutions) >= self.pool_size))
+
+
+def heuristic_repetitions_parallel(heuristic_name: str,
+                                   repeat: int,
+                                   repeat_workers: int,
+                                   repeat_seed: int = None,
+                                   solution_pool: SolutionPool = None,
+                                   **kwargs):
+    """Run the repetitions of a heuristic in a process pool.
+
+    Every repetition seeds random and np.random from its own child of
+    SeedSequence(repeat_seed), drawn from random if not given.
+
+    Returns the number of solutions and the unique solutions, in the order
+    of the first occurrence of each hypervisor set. With a solution_pool
+    only its minimal solutions are returned, and the pending repetitions
+    are cancelled once it is full."""
+    if repeat_seed is None:
+        repeat_seed = random.getrandbits(128)
+    seed_sequences = np.random.SeedSequence(repeat_seed).spawn(repeat)
+
+    unique_solutions = {}
+    with gu.process_pool(repeat_workers, _init_repeat_worker,
+                         (heuristic_name, kwargs)) as executor:
+        for solution in executor.map(_run_heuristic_repetition,
+                                     seed_sequences):
+            if solution_pool is not None:
+                solution_pool.add(solution)
+                if solution_pool.is_full():
+                    executor.shutdown(wait=True, cancel_futures=True)
+                    break
+                continue
+            unique_solutions[frozenset(
+                solution['active_hypervisors'])] = solution
+    if solution_pool is not None:
+        return solution_pool.draws, list(solution_pool.solutions.values())
+    return repeat, list(unique_solutions.values())
+
+
+def heuristic_repetitions_serial(heuristic_name: str,
+                                 repeat: int,
+                                 repeat_seed: int = None,
+                                 solution_pool: SolutionPool = None,
+                                 **kwargs):
+    """Run the repetitions of a heuristic one after another.
+
+    With repeat_seed every repetition is seeded as in
+    heuristic_repetitions_parallel and the state of random and np.random is
+    restored afterwards, so the solutions are the ones of the process pool.
+    With a solution_pool the repetitions stop once it is full.
+
+    Returns the number of solutions and the solutions."""
+    if repeat_seed is not None:
+        seed_sequences = np.random.SeedSequence(repeat_seed).spawn(repeat)
+        random_state = random.getstate()
+        np_random_state = np.random.get_state()
+    solutions = []
+    for i in range(repeat):
+        if repeat_seed is not None:
+            _seed_repetition(seed_sequences[i])
+        if solution_pool is None:
+            solutions.append(heuristics[heuristic_name](**kwargs))
+            continue
+        solution_pool.add(heuristics[heuristic_name](**dict(
+            kwargs, abandon_above=solution_pool.min_h_count)))
+        if solution_pool.is_full():
+            break
+    if repeat_seed is not None:
+        random.setstate(random_state)
+        np.random.set_state(np_random_state)
+    if solution_pool is not None:
+        return solution_pool.draws, list(solution_pool.solutions.values())
+    return len(solutions), solutions
+
+
 def heuristic_repeated(heuristic_name: str = None,
                        repeat: int = 100,
                        candidate_selection: str = 'random',
+                       repeat_workers: int = None,
+                       repeat_seed: int = None,
+                       repeat_patience: int = None,
+                       repeat_pool_size: int = None,
                        **kwargs):
-    solutions = [heuristics[heuristic_name](**kwargs) for _ in range(repeat)]
-    logging.info(f"No. Greedy Solutions: {len(solutions)}")
+    """Run a randomized heuristic repeat times and select one of the
+    solutions with the fewest hypervisors.
+
+    With more than one repeat_workers the repetitions run in a process pool,
+    see heuristic_repetitions_parallel. A repeat_seed gives the same
+    solutions with and without the pool.
+
+    With repeat_patience or repeat_pool_size the repetitions stop early, see
+    SolutionPool. Serial repetitions of hp_combined_S_CS are then abandoned
+    once they use more hypervisors than the current minimum. greedy_max_cover
+    can drop hypervisors while it runs, so it always runs to the end."""
+    solution_pool = (SolutionPool(repeat_patience, repeat_pool_size)
+                     if repeat_patience is not None
+                     or repeat_pool_size is not None else None)
+    if repeat_workers is not None and repeat_workers > 1:
+        solution_count, solutions = heuristic_repetitions_parallel(
+            heuristic_name, repeat, repeat_workers, repeat_seed,
+            solution_pool, **kwargs)
+    else:
+        solution_count, solutions = heuristic_repetitions_serial(
+            heuristic_name, repeat, repeat_seed, solution_pool, **kwargs)
+    logging.info(f"No. Greedy Solutions: {solution_count}")
 
     min_h_count = len(
         min(solutions,
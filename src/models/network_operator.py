@@ -1,6 +1,9 @@
 # Standard library imports.
+import os
 import random
 import copy
+import heapq
+import pickle
 from typing import List
 import logging
 
@@ -13,11 +16,29 @@ from src.logger import measure
 
 import src.data.routing as routing
 import src.data.graph_utilities as gu
+from src.data.path_store import PathStore
 from src.models.hypervisor_placement import hypervisor_placement_solutions
 from src.models import vSDN_request, metrics
 import src.models.controller_placement as controller_placement
 
 
+# Large attributes of the network operator saved as separate artifacts
+ARTIFACTS = {
+    'paths': ['possible_paths', 'path_limits'],
+    'quartet_bounds': ['quartet_bounds'],
+    'quartets':
+    ['quartets', 'quartets_by_controllers', 'quartets_by_switches'],
+    'quartet_indexes': ['quartets_by_cs', 'quartets_by_hh'],
+    'quartet_tensor': ['Qfeas'],
+    'triplets':
+    ['triplets', 'triplets_by_hypervisors', 'triplets_by_switches'],
+}
+
+# Version of the path, quartet and triplet construction and of the pickled
+# network operator state. Cached network operators are keyed on it, so
+# increase it when their results or attributes change.
+ALGORITHM_VERSION = 4
+
 
 # Network operator class
 class NetworkOperator:
@@ -47,11 +68,93 @@ class NetworkOperator:
 
         self.vSDNs = {}
         self.vSDN_control_paths = {}
+        self.pending_control_paths = {}
+        self.control_path_memo = {}
+        self.reset_active_vSDN_index()
 
         self.features = {}
 
-    def __getattribute__(self, name: str):
-        return object.__getattribute__(self, name)
+    def __setstate__(self, state):
+        # Network operators pickled before hypervisor_assignment was a property
+        if 'hypervisor_assignment' in state:
+            state['_hypervisor_assignment'] = state.pop(
+                'hypervisor_assignment')
+            state['_switch_controller_cache'] = None
+        state.setdefault('pending_control_paths', {})
+        state.setdefault('control_path_memo', {})
+        self.__dict__.update(state)
+        if 'active_controllers_by_switch' not in state:
+            self.rebuild_active_vSDN_index()
+
+    @property
+    def hypervisor_assignment(self) -> dict:
+        return self._hypervisor_assignment
+
+    @hypervisor_assignment.setter
+    def hypervisor_assignment(self, hypervisor_assignment: dict):
+        self._hypervisor_assignment = hypervisor_assignment
+        self._switch_controller_cache = None
+
+    def __getattr__(self, name: str):
+        """Load the artifact holding a missing attribute on first access."""
+        artifacts = self.__dict__.get('_artifacts', {})
+        if name not in artifacts:
+            raise AttributeError(name)
+        artifact = artifacts[name]
+        logging.debug(f"Loading {artifact} artifact...")
+        with open(os.path.join(self._artifact_folder, f"{artifact}.p"),
+                  'rb') as f:
+            data = pickle.load(f)
+        if isinstance(data.get('possible_paths'), str):
+            data['possible_paths'] = PathStore.load(
+                os.path.join(self._artifact_folder, data['possible_paths']))
+        for key, value in data.items():
+            artifacts.pop(key, None)
+            setattr(self, key, value)
+        return self.__dict__[name]
+
+    def save_artifacts(self, folder) -> list:
+        """Save the network operator in folder, with each of the ARTIFACTS
+        pickled separately so that it can be loaded lazily.
+
+        Returns the names of the saved files."""
+        state = {}
+        for name, value in self.__dict__.items():
+            if name not in ('_artifacts', '_artifact_folder'):
+                state[name] = value
+        for name in self.__dict__.get('_artifacts', {}).copy():
+            state[name] = getattr(self, name)
+
+        files, artifacts = [], {}
+        for artifact, names in ARTIFACTS.items():
+            data = {name: state.pop(name) for name in names if name in state}
+            if not data:
+                continue
+            if isinstance(data.get('possible_paths'), PathStore):
+                data['possible_paths'].save(os.path.join(folder, "paths"))
+                files.append("paths")
+                # Loaded from the artifact folder, so that it can be moved
+                data['possible_paths'] = "paths"
+            with open(os.path.join(folder, f"{artifact}.p"), 'wb') as f:
+                pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+            files.append(f"{artifact}.p")
+            artifacts.update({name: artifact for name in data})
+
+        network_operator = object.__new__(NetworkOperator)
+        network_operator.__dict__.update(state, _artifacts=artifacts)
+        with open(os.path.join(folder, "network_operator.p"), 'wb') as f:
+            pickle.dump(network_operator, f, pickle.HIGHEST_PROTOCOL)
+        files.append("network_operator.p")
+        return files
+
+    @staticmethod
+    def load(folder):
+        """Load a network operator saved with save_artifacts,
+        its artifacts are loaded on first access."""
+        with open(os.path.join(folder, "network_operator.p"), 'rb') as f:
+            network_operator = pickle.load(f)
+        network_operator._artifact_folder = os.path.abspath(folder)
+        return network_operator
 
     def set_max_length(self, latency_factor, **kwargs):
         self.info['latency_factor'] = latency_factor
@@ -81,52 +184,167 @@ class NetworkOperator:
         return len(self.active_hypervisors)
 
     def get_chs_cp_stat(self, key):
+        # vSDNs deployed with lazy_control_paths are not in cp_stats yet
+        if self.pending_control_paths:
+            self.get_control_path_stats()
         return int(self.cp_stats.get(key, -1))
 
     def get_active_vSDN_count(self):
-        return sum([vSDN.is_active() for _, vSDN in self.vSDNs.items()])
+        return self.active_vSDN_totals['count']
 
     def get_switch_load_total(self):
-        return sum([
-            vSDN.get_size() for _, vSDN in self.vSDNs.items()
-            if vSDN.is_active()
-        ])
+        return self.active_vSDN_totals['switch_load']
 
-    def get_revenue_total(self, **kwargs):
-        return sum([
-            metrics.revenue(vSDN, **kwargs) for _, vSDN in self.vSDNs.items()
-            if vSDN.is_active()
-        ])
+    def get_revenue_total(self, one_timestep: bool = False, **kwargs):
+        if one_timestep:
+            return self.active_vSDN_totals['revenue_one_timestep']
+        return self.active_vSDN_totals['revenue']
 
     #@measure
     def construct_possible_paths(self, **kwargs):
-        if 'max_length' not in kwargs and 'shortest_k' not in kwargs:
-            kwargs = {
-                'max_length': self.info['max_length'],
-                'shortest_k': self.info['shortest_k']
-            }
-        self.possible_paths = routing.get_all_paths(G=self.graph, **kwargs)
+        """Paths below max_length, by default the one of the latency factor,
+        so a derived network operator has the same paths."""
+        kwargs = dict(kwargs)
+        kwargs.setdefault('max_length', self.info['max_length'])
+        kwargs.setdefault('shortest_k', self.info['shortest_k'])
+        self.path_limits = {}
+        self.control_path_memo = {}
+        all_paths = routing.get_all_paths(G=self.graph,
+                                          path_limits=self.path_limits,
+                                          **kwargs)
+        self.possible_paths = PathStore.from_paths(
+            all_paths, routing.get_edge_index(self.graph))
+        self.set_path_limit_info()
         return None
 
+    def set_path_limit_info(self):
+        """Count the node pairs whose path generation ended
+        at the shortest_k or at the max_length limit."""
+        limits = list(self.path_limits.values())
+        self.info['n_k_limited_pairs'] = limits.count('k') // 2
+        self.info['n_length_limited_pairs'] = limits.count('length') // 2
+
     #@measure
     def construct_path_disjoint_triplets(self, **kwargs):
         (self.triplets, self.triplets_by_hypervisors,
          self.triplets_by_switches) = gu.quartets_to_triplets(self.quartets)
         self.info['n_triplets'] = len(self.triplets)
+        self._allowed_hypervisor_pairs_cache = None
+        self._coverage_incidence = None
         return
 
+    def get_coverage_incidence(self):
+        """Switch x hypervisor pair incidence matrix of the triplets,
+        see gu.coverage_incidence."""
+        if self.__dict__.get('_coverage_incidence') is None:
+            self._coverage_incidence = gu.coverage_incidence(
+                self.triplets_by_switches, len(self.nodes))
+        return self._coverage_incidence
+
     #@measure
-    def construct_path_disjoint_quartets(self, **kwargs):
+    def construct_path_disjoint_quartets(self, workers: int = None, **kwargs):
+        """Construct the quartets, sharded by controller
+        across a process pool if more than one worker is given."""
+        quartet_kwargs = dict(all_paths=self.possible_paths,
+                              C=self.possible_controllers,
+                              S=self.nodes,
+                              H=self.possible_hypervisors,
+                              max_length=self.info['max_length'])
+        if workers is not None and workers > 1:
+            quartets = gu.construct_quartets_parallel(workers=workers,
+                                                      **quartet_kwargs)
+        else:
+            quartets = gu.construct_quartets(**quartet_kwargs)
         (self.quartets, self.quartets_by_controllers,
          self.quartets_by_switches, self.quartets_by_cs,
-         self.quartets_by_hh) = gu.construct_quartets(
-             all_paths=self.possible_paths,
-             C=self.possible_controllers,
-             S=self.nodes,
-             H=self.possible_hypervisors,
-             max_length=self.info['max_length'])
+         self.quartets_by_hh) = quartets
         self.info['n_quartets'] = len(self.quartets)
+        self.construct_quartet_tensor()
         return
+
+    def construct_path_disjoint_quartet_bounds(self, **kwargs):
+        """Construct the quartets together with their latency bounds,
+        so the quartets of tighter latency factors can be derived."""
+        self.quartet_bounds = gu.construct_quartet_bounds(
+            all_paths=self.possible_paths,
+            C=self.possible_controllers,
+            S=self.nodes,
+            H=self.possible_hypervisors,
+            max_length=self.info['max_length'])
+        self.info['bounds_max_length'] = self.info['max_length']
+        (self.quartets, self.quartets_by_controllers,
+         self.quartets_by_switches, self.quartets_by_cs,
+         self.quartets_by_hh) = gu.quartets_from_bounds(
+             self.quartet_bounds, self.info['max_length'])
+        self.info['n_quartets'] = len(self.quartets)
+        self.construct_quartet_tensor()
+        return
+
+    def construct_quartet_tensor(self):
+        """Boolean tensor Qfeas[c, h, h_, s] for the quartet membership
+        checks."""
+        self.Qfeas = gu.quartet_tensor(self.quartets, len(self.nodes))
+        self._hypervisor_pair_incidence = None
+
+    def get_hypervisor_pair_incidence(self):
+        """Hypervisor pair x controller-switch pair incidence matrix of the
+        quartets, see gu.hypervisor_pair_incidence."""
+        if self.__dict__.get('_hypervisor_pair_incidence') is None:
+            self._hypervisor_pair_incidence = gu.hypervisor_pair_incidence(
+                self.Qfeas)
+        return self._hypervisor_pair_incidence
+
+    def derive_network_operator(self, latency_factor, **kwargs):
+        """Return a copy of the network operator for a tighter latency factor.
+
+        The paths and quartets are filtered from the ones of this operator
+        using the quartet bounds instead of being constructed again."""
+        max_length = latency_factor * self.info['graph_diameter']
+        if max_length > self.info.get('bounds_max_length', -np.inf):
+            raise ValueError(
+                f"Cannot derive latency factor {latency_factor}: max_length "
+                f"{max_length} exceeds the quartet bounds' max_length "
+                f"{self.info.get('bounds_max_length')}")
+
+        # Share the large structures instead of copying them,
+        # they are replaced in the copy.
+        shared = [
+            getattr(self, name, None) for name in [
+                'graph', 'possible_paths', 'path_limits', 'quartet_bounds',
+                'quartets',
+                'quartets_by_controllers', 'quartets_by_switches',
+                'quartets_by_cs', 'quartets_by_hh', 'Qfeas', 'triplets',
+                'triplets_by_hypervisors', 'triplets_by_switches'
+            ]
+        ]
+        network_operator = copy.deepcopy(self,
+                                         memo={id(x): x
+                                               for x in shared})
+        network_operator.__dict__.pop('_artifacts', None)
+        network_operator.__dict__.pop('_artifact_folder', None)
+        network_operator.control_path_memo = {}
+        del network_operator.quartet_bounds
+        del network_operator.info['bounds_max_length']
+
+        network_operator.set_max_length(latency_factor)
+        network_operator.possible_paths = routing.filter_paths(
+            self.possible_paths, network_operator.info['max_length'])
+        network_operator.path_limits = {
+            key: ('length' if network_operator.possible_paths.count(key) <
+                  self.possible_paths.count(key) else getattr(
+                      self, 'path_limits', {}).get(key))
+            for key in network_operator.possible_paths
+        }
+        network_operator.set_path_limit_info()
+        (network_operator.quartets, network_operator.quartets_by_controllers,
+         network_operator.quartets_by_switches,
+         network_operator.quartets_by_cs,
+         network_operator.quartets_by_hh) = gu.quartets_from_bounds(
+             self.quartet_bounds, network_operator.info['max_length'])
+        network_operator.info['n_quartets'] = len(network_operator.quartets)
+        network_operator.construct_quartet_tensor()
+        network_operator.construct_path_disjoint_triplets()
+        return network_operator
     
     # - the number of quartets that contain the node as hypervisor
     def calculate_hQ_values(self):
@@ -184,38 +402,58 @@ class NetworkOperator:
 
     def get_allowed_hypervisor_pairs_by_switch(self, get_all: bool = False):
         """Return the hypervisor pairs that enable control paths
-        with the current latency requirement."""
-        _, active_controllers_by_switch = self.get_active_CS_pairs()
-        allowed_hypervisor_pairs_by_switch = {}
-        for s, triplets in self.triplets_by_switches.items():
-            if s in active_controllers_by_switch.keys() and not get_all:
-                for i, c in enumerate(active_controllers_by_switch[s]):
-                    if i == 0:
-                        allowed_hypervisor_pairs_by_switch[
-                            s] = self.quartets_by_cs[(c, s)]
-                    else:
-                        allowed_hypervisor_pairs_by_switch[
-                            s] = allowed_hypervisor_pairs_by_switch[
-                                s].intersection(self.quartets_by_cs[(c, s)])
-            else:
-                allowed_hypervisor_pairs_by_switch[s] = set([
-                    (i, j) for _, i, j in triplets if (i <= j)
-                ])
-        return allowed_hypervisor_pairs_by_switch
+        with the current latency requirement.
+
+        The pairs of a switch are only computed again after the set of
+        active controllers of the switch changed."""
+        cache = self._allowed_hypervisor_pairs_cache
+        if cache is None:
+            all_pairs = {
+                s: set([(i, j) for _, i, j in triplets if (i <= j)])
+                for s, triplets in self.triplets_by_switches.items()
+            }
+            cache = self._allowed_hypervisor_pairs_cache = {
+                'all': all_pairs,
+                'allowed': dict(all_pairs),
+            }
+            self.dirty_switches = set(self.active_controllers_by_switch)
+        if get_all:
+            return dict(cache['all'])
+
+        allowed = cache['allowed']
+        for s in self.dirty_switches:
+            if s not in allowed:
+                continue
+            if s not in self.active_controllers_by_switch:
+                allowed[s] = cache['all'][s]
+                continue
+            for i, c in enumerate(self.active_controllers_by_switch[s]):
+                if i == 0:
+                    allowed[s] = self.quartets_by_cs[(c, s)]
+                else:
+                    allowed[s] = allowed[s].intersection(
+                        self.quartets_by_cs[(c, s)])
+        self.dirty_switches = set()
+        return dict(allowed)
 
     def get_active_CS_pairs(self) -> set:
-        active_cs_pairs = set()
-        active_controllers_by_switch = {}
-        for vSDN in self.get_active_vSDNs():
-            c = vSDN.get_controller()
-            for s in vSDN.get_switches():
-                active_cs_pairs.add((c, s))
-                active_controllers_by_switch.setdefault(s, set()).add(c)
+        active_controllers_by_switch = {
+            s: set(controllers)
+            for s, controllers in self.active_controllers_by_switch.items()
+        }
+        active_cs_pairs = set([(c, s) for s, controllers in
+                               active_controllers_by_switch.items()
+                               for c in controllers])
         return active_cs_pairs, active_controllers_by_switch
 
-    def control_path_calculation(self, **kwargs) -> None:
+    def control_path_calculation(self,
+                                 with_bounds: bool = False,
+                                 **kwargs) -> None:
         self.construct_possible_paths(**kwargs)
-        self.construct_path_disjoint_quartets(**kwargs)
+        if with_bounds:
+            self.construct_path_disjoint_quartet_bounds(**kwargs)
+        else:
+            self.construct_path_disjoint_quartets(**kwargs)
         self.construct_path_disjoint_triplets(**kwargs)
         return
 
@@ -254,6 +492,8 @@ class NetworkOperator:
             if ' ' not in key:
                 self.info[key] = result[key]
 
+        self.update_switch_controller_cache()
+
         # if 'request status' in result:
         #     print(result.get('request status'))
         return
@@ -277,6 +517,7 @@ class NetworkOperator:
                  all_paths=self.possible_paths,
                  **kwargs)
             self.set_active_hypervisor_info()
+        self.update_switch_controller_cache()
         return self.preprocess_vSDN_requests(request_list)
 
     def get_minimal_hypervisor_count(self, **kwargs) -> int:
@@ -315,7 +556,7 @@ class NetworkOperator:
 
         for i, request in enumerate(request_list):
             if deploy:
-                self.vSDNs.setdefault(request.id, copy.deepcopy(request))
+                self.add_vSDN(request)
             #print(request)
 
             if not (set(request.get_switches()) <= set(self.nodes)):
@@ -328,11 +569,9 @@ class NetworkOperator:
 
             possible = c is not None
             if possible:
+                masks = self.get_switch_controller_masks()
                 for s in request.get_switches():
-                    h, h_ = self.hypervisor_assignment[s]
-                    if not (
-                        ((c, h, h_, s) in self.quartets_by_controllers[c]) or
-                        ((c, h_, h, s) in self.quartets_by_controllers[c])):
+                    if not masks[s] >> c & 1:
                         possible = False
                         break
 
@@ -350,7 +589,133 @@ class NetworkOperator:
         # print(f"Acceptance ratio: {np.mean(accepted):.3f}")
         return accepted
 
+    def update_switch_controller_cache(self) -> None:
+        """Cache the controllers that can control each switch through the
+        hypervisor pair assigned to it, as a boolean matrix F[s, c], as one
+        bitmask per switch and as one set per switch.
+
+        Setting hypervisor_assignment invalidates the cache."""
+        n = len(self.nodes)
+        hypervisor_assignment = self.hypervisor_assignment or {}
+        F = np.zeros((n, n), dtype=bool)
+        S = [
+            s for s, (h, h_) in hypervisor_assignment.items()
+            if h >= 0 and h_ >= 0
+        ]
+        if S:
+            H = np.array([hypervisor_assignment[s] for s in S])
+            F[S] = self.Qfeas[:, H[:, 0], H[:, 1], S].T
+        F[:, list(set(self.nodes) - set(self.possible_controllers))] = False
+
+        feasible = F.tolist()
+        self._switch_controller_cache = {
+            'matrix':
+            F,
+            'masks': [
+                int.from_bytes(row.tobytes(), 'little')
+                for row in np.packbits(F, axis=1, bitorder='little')
+            ],
+            # Built in the order of possible_controllers, so that the
+            # iteration order of the controller sets stays the same
+            'sets': [{c
+                      for c in self.possible_controllers if feasible[s][c]}
+                     for s in range(n)],
+        }
+
+    def get_switch_controller_cache(self) -> dict:
+        if self._switch_controller_cache is None:
+            self.update_switch_controller_cache()
+        return self._switch_controller_cache
+
+    def get_switch_controller_feasibility(self) -> np.ndarray:
+        """Boolean matrix F[s, c] that tells if controller c can control
+        switch s through the hypervisor pair assigned to s."""
+        return self.get_switch_controller_cache()['matrix']
+
+    def get_switch_controller_masks(self) -> list:
+        """Bitmask of the controllers that can control each switch."""
+        return self.get_switch_controller_cache()['masks']
+
+    def get_switch_controller_sets(self) -> list:
+        """Set of the controllers that can control each switch."""
+        return self.get_switch_controller_cache()['sets']
+
+    def process_vSDN_requests_batch(
+            self,
+            request_list: List[vSDN_request.vSDN_request],
+            deploy: bool = True,
+            **kwargs) -> List[bool]:
+        """Same as process_vSDN_requests, but the possible controllers of
+        all requests are computed at once from the switch-controller
+        feasibility matrix, only the deployment is done request by request.
+
+        The possible controllers are handed to the controller placement in
+        ascending order, so a random controller choice can differ from
+        process_vSDN_requests with the same seed."""
+        accepted = [False] * len(request_list)
+        nodes = set(self.nodes)
+        valid = [
+            set(request.get_switches()) <= nodes for request in request_list
+        ]
+        R = vSDN_request.get_switch_matrix([
+            request.get_switches() if valid_ else []
+            for request, valid_ in zip(request_list, valid)
+        ], len(self.nodes))
+        F = self.get_switch_controller_feasibility()
+        sizes = np.asarray(R.sum(axis=1)).ravel()
+        possible_controllers = (R @ F.astype(np.int32)) == sizes[:, None]
+        possible_controllers[:, list(nodes -
+                                     set(self.possible_controllers))] = False
+
+        controller_placement_algorithm = controller_placement.algorithms[
+            kwargs.get('cp_method', 'random_controller')]
+        for i, request in enumerate(request_list):
+            if deploy:
+                self.add_vSDN(request)
+
+            if not valid[i]:
+                print("Invalid request:", "Wrong switches - ",
+                      request.get_switches())
+                continue
+
+            c = controller_placement_algorithm(
+                self,
+                request,
+                possible_controllers_=set(
+                    np.flatnonzero(possible_controllers[i]).tolist()))
+            accepted[i] = c is not None
+
+            if not deploy:
+                continue
+
+            if accepted[i]:
+                self.deploy_vSDN(request, c, **kwargs)
+            else:
+                if request.is_active() and request.get_id() in self.vSDNs:
+                    self.deactivate_vSDN(request.get_id(), **kwargs)
+        return accepted
+
+    def get_full_control_path(self, c, h, h_, s) -> dict:
+        """Best control path of the quartet (c, h, h_, s),
+        memoized across requests and simulation rounds."""
+        key = (c, h, h_, s, self.info['max_length'])
+        if key not in self.control_path_memo:
+            self.control_path_memo[key] = routing.full_control_path(
+                self.possible_paths, c, h, h_, s, self.info['max_length'])
+        return self.control_path_memo[key]
+
+    def compute_pending_control_paths(self) -> None:
+        """Compute the control paths of the vSDNs deployed with
+        lazy_control_paths."""
+        for id, hypervisor_pairs in self.pending_control_paths.items():
+            self.vSDN_control_paths[id] = {
+                (c, s): self.get_full_control_path(c, h, h_, s)
+                for (c, s), (h, h_) in hypervisor_pairs.items()
+            }
+        self.pending_control_paths = {}
+
     def get_control_path_stats(self) -> None:
+        self.compute_pending_control_paths()
         primary_path_lengths, secondary_path_lengths = [], []
         for vSDN in self.get_active_vSDNs():
             for _, p in self.vSDN_control_paths[vSDN.get_id()].items():
@@ -373,60 +738,153 @@ class NetworkOperator:
             self.cp_stats = {}
             return
 
+    def reset_active_vSDN_index(self) -> None:
+        """Empty the index of the active vSDNs.
+
+        The index holds the ids of the active vSDNs in deployment order, a
+        min-heap of (end time, id) entries and the running totals of the
+        active vSDNs. Heap entries of vSDNs that were deactivated or
+        deployed again are skipped when they are popped.
+
+        The number of active vSDNs with controller c and switch s is kept
+        in active_controllers_by_switch[s][c], and the switches whose set
+        of active controllers changed are marked as dirty."""
+        self.active_vSDN_ids = {}
+        self.expiry_heap = []
+        self.active_controllers_by_switch = {}
+        self.dirty_switches = set()
+        self._allowed_hypervisor_pairs_cache = None
+        self.active_vSDN_totals = {
+            'count': 0,
+            'switch_load': 0,
+            'revenue': 0,
+            'revenue_one_timestep': 0,
+        }
+
+    def rebuild_active_vSDN_index(self) -> None:
+        """Build the index of the active vSDNs from scratch."""
+        self.reset_active_vSDN_index()
+        for vSDN in self.vSDNs.values():
+            if vSDN.is_active():
+                self.add_active_vSDN(vSDN)
+
+    def update_active_vSDN_totals(self, vSDN, sign: int) -> None:
+        totals = self.active_vSDN_totals
+        totals['count'] += sign
+        totals['switch_load'] += sign * vSDN.get_size()
+        totals['revenue'] += sign * int(metrics.revenue(vSDN))
+        totals['revenue_one_timestep'] += sign * int(
+            metrics.revenue(vSDN, one_timestep=True))
+
+        c = vSDN.get_controller()
+        for s in vSDN.get_switches():
+            controllers = self.active_controllers_by_switch.setdefault(s, {})
+            count = controllers.get(c, 0) + sign
+            if count > 0:
+                controllers[c] = count
+            else:
+                del controllers[c]
+                if not controllers:
+                    del self.active_controllers_by_switch[s]
+            if count == 0 or (sign > 0 and count == 1):
+                self.dirty_switches.add(s)
+
+    def add_vSDN(self, request) -> None:
+        """Keep a copy of a request that is not known yet.
+
+        A request that is already active, e.g. of a request list processed
+        again after delete_all_vSDNs, is added to the active index too."""
+        if request.get_id() not in self.vSDNs:
+            self.vSDNs[request.get_id()] = request.copy()
+            if request.is_active():
+                self.add_active_vSDN(self.vSDNs[request.get_id()])
+
+    def add_active_vSDN(self, vSDN) -> None:
+        self.active_vSDN_ids[vSDN.get_id()] = None
+        heapq.heappush(self.expiry_heap,
+                       (vSDN.get_end_time(), vSDN.get_id()))
+        self.update_active_vSDN_totals(vSDN, 1)
+
     def deploy_vSDN(self,
                     request: vSDN_request,
                     c: int,
                     time: int = None,
+                    lazy_control_paths: bool = False,
                     **kwargs) -> None:
+        """Deploy the request with controller c.
+
+        With lazy_control_paths the control paths are only computed when
+        the control path statistics are requested."""
+        if request.get_id() in self.active_vSDN_ids:
+            self.update_active_vSDN_totals(self.vSDNs[request.get_id()], -1)
         request.set_controller(c)
         request.set_active()
-        self.vSDNs[request.get_id()] = copy.deepcopy(request)
+        self.vSDNs[request.get_id()] = request.copy()
+        self.add_active_vSDN(self.vSDNs[request.get_id()])
+
+        if lazy_control_paths:
+            self.pending_control_paths[request.get_id()] = {
+                (c, s): self.hypervisor_assignment[s]
+                for s in request.get_switches()
+            }
+            return
 
         self.vSDN_control_paths[request.get_id()] = {}
         for s in request.get_switches():
             h, h_ = self.hypervisor_assignment[s]
             self.vSDN_control_paths[request.get_id()][(
-                c, s)] = routing.full_control_path(self.possible_paths, c, h,
-                                                   h_, s,
-                                                   self.info['max_length'])
+                c, s)] = self.get_full_control_path(c, h, h_, s)
         return
 
-    def deactivate_vSDN(self, id, time) -> None:
+    def deactivate_vSDN(self, id, time=None, **kwargs) -> None:
+        """Deactivate a vSDN at time, by default at its end time."""
+        if id in self.active_vSDN_ids:
+            self.update_active_vSDN_totals(self.vSDNs[id], -1)
+            del self.active_vSDN_ids[id]
         self.vSDNs[id].set_inactive()
-        self.vSDNs[id].set_end_time(time)
+        self.vSDNs[id].set_end_time(
+            self.vSDNs[id].get_end_time() if time is None else time)
 
         _ = self.vSDN_control_paths.pop(id, None)
+        _ = self.pending_control_paths.pop(id, None)
         _ = self.cp_stats.pop(id, None)
         return
 
     def delete_all_vSDNs(self) -> None:
         self.vSDNs = {}
         self.vSDN_control_paths = {}
+        self.pending_control_paths = {}
         self.cp_stats = {}
+        self.reset_active_vSDN_index()
         return
 
-    def deactivate_old_vSDNs(self, time) -> None:
-        for vSDN in self.get_active_vSDNs():
-            if vSDN.get_end_time() <= time:
-                self.deactivate_vSDN(vSDN.get_id(), time)
+    def deactivate_old_vSDNs(self, time, at_end_time: bool = False) -> None:
+        """Deactivate the vSDNs that end at or before time.
+
+        The vSDNs get time as end time, or their own end time with
+        at_end_time."""
+        while self.expiry_heap and self.expiry_heap[0][0] <= time:
+            end_time, id = heapq.heappop(self.expiry_heap)
+            if (id not in self.active_vSDN_ids
+                    or self.vSDNs[id].get_end_time() != end_time):
+                continue
+            self.deactivate_vSDN(id, end_time if at_end_time else time)
         return
 
     def deactivate_all_vSDNs(self) -> None:
         for vSDN in self.get_active_vSDNs():
             self.deactivate_vSDN(vSDN.get_id(), vSDN.get_end_time())
+        self.expiry_heap = []
         return
 
     def get_active_controllers(self) -> list:
         return [
-            vSDN.get_controller() for _, vSDN in self.vSDNs.items()
-            if vSDN.is_active()
+            self.vSDNs[vSDN_id].get_controller()
+            for vSDN_id in self.active_vSDN_ids
         ]
 
     def get_active_vSDNs(self, only_ids: bool = False) -> list:
         if only_ids:
-            return [
-                vSDN_id for vSDN_id, vSDN in self.vSDNs.items()
-                if vSDN.is_active()
-            ]
+            return list(self.active_vSDN_ids)
         else:
-            return [vSDN for _, vSDN in self.vSDNs.items() if vSDN.is_active()]
+            return [self.vSDNs[vSDN_id] for vSDN_id in self.active_vSDN_ids]
@@ -2,6 +2,8 @@
 import os
 import datetime
 import pickle
+import hashlib
+import json
 import pathlib
 import itertools
 from typing import List
@@ -22,6 +24,28 @@ logging.basicConfig(
 )
 
 
+# Network operators built at the loosest latency factor of a sweep,
+# shared by the simulations running in the same process. At most
+# MAX_BASE_NETWORK_OPERATORS are kept, the least recently used is evicted.
+base_network_operators = {}
+MAX_BASE_NETWORK_OPERATORS = 2
+
+
+def clear_base_network_operators() -> None:
+    """Drop the cached base network operators to free their memory."""
+    base_network_operators.clear()
+
+
+def admission_settings(settings: dict) -> dict:
+    """The request admission settings that the dynamic simulations pass on
+    to setup_vSDN_requests."""
+    return {
+        key: settings[key]
+        for key in ('batch_admission', 'lazy_control_paths')
+        if key in settings
+    }
+
+
 def generate_setting_list(setting_dict: dict) -> list:
     if setting_dict is None:
         raise ValueError
@@ -72,42 +96,108 @@ class NetworkSimulation:
             os.mkdir(self.settings['result_folder'])
         return
 
-    def get_network_operator_path(self, latency_factor, shortest_k, **kwargs):
-        return pathlib.Path(
-            f"{self.settings['network_operator_folder']}{self.settings['network_name']}_L{str(int(latency_factor*100))}_k{shortest_k}.p"
-        )
+    def get_network_hash(self) -> str:
+        """SHA-256 of the GML file of the network."""
+        if 'network_hash' not in self.settings:
+            with open(self.settings['network_path'], 'rb') as f:
+                self.settings['network_hash'] = hashlib.sha256(
+                    f.read()).hexdigest()
+        return self.settings['network_hash']
+
+    def get_network_operator_manifest(self, latency_factor, shortest_k,
+                                      **kwargs) -> dict:
+        """Everything the network operator artifacts depend on."""
+        return {
+            'network_name': self.settings['network_name'],
+            'network_hash': self.get_network_hash(),
+            'latency_factor': float(latency_factor),
+            'shortest_k': int(shortest_k),
+            'algorithm_version': network_operator.ALGORITHM_VERSION
+        }
+
+    def get_network_operator_key(self, **kwargs) -> str:
+        manifest = self.get_network_operator_manifest(**kwargs)
+        return hashlib.sha256(
+            json.dumps(manifest, sort_keys=True).encode()).hexdigest()
+
+    def get_network_operator_cache_folder(self, **kwargs):
+        key = self.get_network_operator_key(**kwargs)[:16]
+        return pathlib.Path(f"{self.settings['network_operator_folder']}"
+                            f"{self.settings['network_name']}_{key}")
+
+    def get_network_operator_path(self, **kwargs):
+        return self.get_network_operator_cache_folder(
+            **kwargs) / "network_operator.p"
 
     def is_network_operator_file_available(self, **kwargs) -> bool:
-        network_operator_path = self.get_network_operator_path(**kwargs)
-        return network_operator_path.is_file()
+        manifest_path = self.get_network_operator_cache_folder(
+            **kwargs) / "manifest.json"
+        if not manifest_path.is_file():
+            return False
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        return (manifest.get('key') == self.get_network_operator_key(**kwargs)
+                and self.get_network_operator_path(**kwargs).is_file())
 
     def is_network_operator_file_outdated(self, **kwargs) -> bool:
-        network_operator_path = self.get_network_operator_path(**kwargs)
-        if not self.is_network_operator_file_available(**kwargs):
-            return True
-        else:
-            return os.path.getmtime(
-                network_operator_path) < os.path.getmtime(
-                    "../src/models/network_operator.py")
+        return not self.is_network_operator_file_available(**kwargs)
+
+    def get_stale_network_operator_files(self, latency_factor, shortest_k,
+                                         **kwargs) -> List[pathlib.Path]:
+        """Cached network operators of the same network, latency factor and
+        shortest_k that are no longer read: the single-pickle files of the
+        versions before the cache folders, and cache folders of another
+        algorithm version or network file."""
+        folder = pathlib.Path(self.settings['network_operator_folder'])
+        name = self.settings['network_name']
+        stale = [
+            folder / f"{name}_L{int(latency_factor * 100)}_k{shortest_k}.p"
+        ]
+        current = self.get_network_operator_cache_folder(
+            latency_factor=latency_factor, shortest_k=shortest_k)
+        for manifest_path in folder.glob(f"{name}_*/manifest.json"):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            if (manifest_path.parent != current
+                    and manifest.get('latency_factor') == latency_factor
+                    and manifest.get('shortest_k') == shortest_k):
+                stale.append(manifest_path.parent)
+        return [path for path in stale if path.exists()]
 
     def init_network_operator(self, **kwargs) -> None:
         network_operator_path = self.get_network_operator_path(**kwargs)
         if not self.is_network_operator_file_outdated(**kwargs):
             logging.info("Loading network operator...")
-            self.network_operator = pickle.load(
-                open(network_operator_path, "rb"))
+            self.network_operator = network_operator.NetworkOperator.load(
+                network_operator_path.parent)
         else:
+            for path in self.get_stale_network_operator_files(**kwargs):
+                logging.warning(f"Ignoring stale network operator '{path}' "
+                                f"(algorithm version "
+                                f"{network_operator.ALGORITHM_VERSION} "
+                                f"required), it can be deleted.")
             logging.info("Creating network operator...")
             self.network_operator = network_operator.NetworkOperator(
                 path=self.settings['network_path'])
         return
 
     def save_network_operator(self, **kwargs) -> None:
-        network_operator_path = self.get_network_operator_path(**kwargs)
         if self.is_network_operator_file_outdated(**kwargs):
-            self.save2pickle(network_operator_path, self.network_operator)
+            self.save_network_operator_file(self.network_operator, **kwargs)
         return
 
+    def save_network_operator_file(self, network_operator, **kwargs):
+        """Save the network operator artifacts in the cache folder of its key.
+
+        The manifest is written last, so an interrupted save is rebuilt."""
+        folder = self.get_network_operator_cache_folder(**kwargs)
+        os.makedirs(folder, exist_ok=True)
+        manifest = self.get_network_operator_manifest(**kwargs)
+        manifest['key'] = self.get_network_operator_key(**kwargs)
+        manifest['created'] = datetime.datetime.now().isoformat()
+        manifest['artifacts'] = network_operator.save_artifacts(str(folder))
+        save2json(path=folder / "manifest.json", data=manifest)
+
     def init_request_generators(self, **kwargs) -> None:
         self.request_generator_static = vSDN_request.vSDN_request_generator(
             self.settings['network_name'], self.settings['request_folder'],
@@ -120,14 +210,55 @@ class NetworkSimulation:
             **kwargs)
         return
 
-    def init_simulation(self, **kwargs) -> None:
+    def init_simulation(self,
+                        max_latency_factor: float = None,
+                        **kwargs) -> None:
+        """Prepare the network operator for the latency factor.
+
+        With max_latency_factor the paths and quartets are derived from
+        an operator built once at that (loosest) latency factor."""
         if self.is_network_operator_file_outdated(**kwargs):
-            self.network_operator.set_max_length(**kwargs)
-            self.network_operator.set_shortest_k(**kwargs)
-            self.network_operator.control_path_calculation(**kwargs)
+            if max_latency_factor is not None:
+                self.network_operator = self.get_base_network_operator(
+                    max_latency_factor,
+                    **kwargs).derive_network_operator(**kwargs)
+            else:
+                self.network_operator.set_max_length(**kwargs)
+                self.network_operator.set_shortest_k(**kwargs)
+                self.network_operator.control_path_calculation(**kwargs)
             self.save_network_operator(**kwargs)
         return
 
+    def get_base_network_operator(
+            self, max_latency_factor: float, shortest_k: int,
+            **kwargs) -> network_operator.NetworkOperator:
+        """Network operator with quartet bounds at max_latency_factor."""
+        key = (self.settings['network_name'], max_latency_factor, shortest_k)
+        if key in base_network_operators:
+            base_network_operators[key] = base_network_operators.pop(key)
+            return base_network_operators[key]
+
+        base_kwargs = dict(kwargs,
+                           latency_factor=max_latency_factor,
+                           shortest_k=shortest_k)
+        base = None
+        if not self.is_network_operator_file_outdated(**base_kwargs):
+            logging.info("Loading base network operator...")
+            base = network_operator.NetworkOperator.load(
+                self.get_network_operator_cache_folder(**base_kwargs))
+        if getattr(base, 'quartet_bounds', None) is None:
+            logging.info("Creating base network operator...")
+            base = network_operator.NetworkOperator(
+                path=self.settings['network_path'])
+            base.set_max_length(**base_kwargs)
+            base.set_shortest_k(**base_kwargs)
+            base.control_path_calculation(with_bounds=True, **base_kwargs)
+            self.save_network_operator_file(base, **base_kwargs)
+        while len(base_network_operators) >= MAX_BASE_NETWORK_OPERATORS:
+            del base_network_operators[next(iter(base_network_operators))]
+        base_network_operators[key] = base
+        return base
+
     def run_static_simulation(self,
                               possible_request_settings: dict = None,
                               skip_evaluation: bool = False,
@@ -273,7 +404,7 @@ class NetworkSimulation:
             new_placement = set(self.network_operator.get_active_hypervisors())
             self.results['hp_changed'] = len(new_placement - current_placement)
             # print(f"Current: {current_placement}\nNew: {new_placement}")
-            self.setup_vSDN_requests()
+            self.setup_vSDN_requests(**admission_settings(kwargs))
             self.timestep_statistics()
             _ = self.log_simulation()
 
@@ -312,7 +443,31 @@ class NetworkSimulation:
             new_placement = set(self.network_operator.get_active_hypervisors())
             self.results['hp_changed'] = len(new_placement - current_placement)
             # print(f"Current: {current_placement}\nNew: {new_placement}")
-            self.setup_vSDN_requests(time=self.results['timestep'])
+            self.setup_vSDN_requests(time=self.results['timestep'],
+                                     **admission_settings(kwargs))
+            self.timestep_statistics()
+            _ = self.log_simulation()
+
+        self.deactivate_vSDNs(all=True)
+        return
+
+    def run_poisson_dynamic_simulation(self,
+                                       timesteps: int = 100,
+                                       **kwargs) -> None:
+        """
+        t=0 Hypervisor placement.
+        t>0 Requests are arriving as a Poisson process, each one is
+            processed at its arrival time, reject new if not acceptable.
+            No Reconfiguration!
+        """
+        self.results['timestep'] = 0
+        self.delete_all_vSDNs()
+        self.settings['simulation_timesteps'] = timesteps
+
+        self.hypervisor_placement(**kwargs)
+
+        for _ in range(self.settings['simulation_timesteps']):
+            self.next_poisson_timestep(**kwargs)
             self.timestep_statistics()
             _ = self.log_simulation()
 
@@ -337,6 +492,8 @@ class NetworkSimulation:
                 self.run_conservative_dynamic_simulation(**kwargs)
             elif dynamic_type == 'liberal':
                 self.run_liberal_dynamic_simulation(**kwargs)
+            elif dynamic_type == 'poisson':
+                self.run_poisson_dynamic_simulation(**kwargs)
             else:
                 pass
             self.save_vSDN_history(only_current_round=True)
@@ -352,6 +509,58 @@ class NetworkSimulation:
         self.results['timestep'] += 1
         self.deactivate_vSDNs()
 
+        self.timestep_settings(**kwargs)
+        request_generator = self.request_generator_dynamic
+        self.vSDN_requests = request_generator.get_random_vSDN_requests(
+            **dict(kwargs,
+                   total_count=request_per_timestep,
+                   time_=self.results['timestep']))
+
+        # ! Add vSDN preprocessing
+        if to_setup:
+            self.setup_vSDN_requests(**admission_settings(kwargs))
+
+    def next_poisson_timestep(self,
+                              request_per_timestep: int = 10,
+                              lazy_control_paths: bool = False,
+                              **kwargs) -> None:
+        """Requests arrive as a Poisson process with request_per_timestep
+        arrivals per timestep. Before each arrival the vSDNs that ended
+        before it are deactivated at their end time."""
+        start_time = self.results['timestep']
+        self.results['timestep'] += 1
+
+        self.timestep_settings(**kwargs)
+        request_generator = self.request_generator_dynamic
+        random_generator = request_generator.random_generator
+        request_count = random_generator.poisson(request_per_timestep)
+        arrival_times = np.sort(
+            random_generator.uniform(start_time, self.results['timestep'],
+                                     request_count))
+        self.vSDN_requests = request_generator.get_random_vSDN_requests(
+            **dict(kwargs, total_count=request_count, time_=start_time))
+
+        self.accepted_vSDN_requests = []
+        for request, arrival_time in zip(self.vSDN_requests,
+                                         arrival_times.tolist()):
+            request.set_start_time(arrival_time)
+            self.network_operator.deactivate_old_vSDNs(arrival_time,
+                                                       at_end_time=True)
+            self.accepted_vSDN_requests.extend(
+                self.network_operator.process_vSDN_requests(
+                    request_list=[request],
+                    lazy_control_paths=lazy_control_paths,
+                    **kwargs))
+        self.network_operator.deactivate_old_vSDNs(self.results['timestep'],
+                                                   at_end_time=True)
+
+        self.results['vSDN_accepted_count'] = sum(self.accepted_vSDN_requests)
+        self.results['vSDN_acceptance_ratio'] = self.results[
+            'vSDN_accepted_count'] / max(1, len(self.vSDN_requests))
+        if not lazy_control_paths:
+            _ = self.network_operator.get_control_path_stats()
+
+    def timestep_settings(self, **kwargs) -> None:
         switch_hpairs = self.network_operator.get_allowed_hypervisor_pairs_by_switch(
         )
         self.results['switch_hpair_count'] = [
@@ -361,14 +570,6 @@ class NetworkSimulation:
             self.results['switch_hpair_count'])
         self.settings['TTL_max'] = kwargs.get('TTL_range', 0)
         self.settings['max_vSDN_size'] = kwargs.get('max_request_size', 0)
-        self.vSDN_requests = self.request_generator_dynamic.get_random_vSDN_requests(
-            **dict(kwargs,
-                   total_count=request_per_timestep,
-                   time_=self.results['timestep']))
-
-        # ! Add vSDN preprocessing
-        if to_setup:
-            self.setup_vSDN_requests()
 
     def hypervisor_placement(self, **kwargs) -> None:
         self.network_operator.hypervisor_placement(**dict(
@@ -419,7 +620,8 @@ class NetworkSimulation:
             self.vSDN_requests_ilp = self.request_generator_representative.get_random_vSDN_requests(
                 max_request_size=vSDN_size_ilp,
                 total_count=vSDN_count_ilp,
-                time_=self.results['timestep'])
+                time_=self.results['timestep'],
+                bulk_sampling=kwargs.get('bulk_sampling', False))
             return self.vSDN_requests_ilp
         else:
             return kwargs.get('vSDN_requests_ilp', None)
@@ -429,17 +631,34 @@ class NetworkSimulation:
             request_list=self.vSDN_requests)
 
     @measure
-    def setup_vSDN_requests(self, **kwargs) -> None:
+    def setup_vSDN_requests(self,
+                            batch_admission: bool = False,
+                            lazy_control_paths: bool = False,
+                            **kwargs) -> None:
+        """Process the vSDN requests of the timestep.
+
+        With lazy_control_paths the control paths of the deployed vSDNs and
+        their statistics are only computed when a statistic is read with
+        NetworkOperator.get_chs_cp_stat."""
         if self.settings['auto_accept']:
             self.accepted_vSDN_requests = [True] * len(self.vSDN_requests)
+        elif batch_admission:
+            self.accepted_vSDN_requests = (
+                self.network_operator.process_vSDN_requests_batch(
+                    request_list=self.vSDN_requests,
+                    lazy_control_paths=lazy_control_paths,
+                    **kwargs))
         else:
             self.accepted_vSDN_requests = self.network_operator.process_vSDN_requests(
-                request_list=self.vSDN_requests, **kwargs)
+                request_list=self.vSDN_requests,
+                lazy_control_paths=lazy_control_paths,
+                **kwargs)
 
         self.results['vSDN_accepted_count'] = sum(self.accepted_vSDN_requests)
         self.results['vSDN_acceptance_ratio'] = self.results[
             'vSDN_accepted_count'] / len(self.vSDN_requests)
-        _ = self.network_operator.get_control_path_stats()
+        if not lazy_control_paths:
+            _ = self.network_operator.get_control_path_stats()
         # print(latency_factor, max_length, request_size,
         #       len(self.network_operator.active_hypervisors), acceptance_ratio,
         #       *x)
@@ -3,12 +3,15 @@ import itertools
 import random
 import glob
 import re
-import linecache
+import os
+import mmap
+import logging
 import typing
 from typing import List, Tuple
 
 # Related third party imports.
 import numpy as np
+import scipy.sparse
 
 # Local application/library specific imports.
 import src.models.metrics as metrics
@@ -81,6 +84,8 @@ import src.models.metrics as metrics
 
 
 class vSDN_request(object):
+    __slots__ = ('id', 'controller', 'switches', 'TTL', 'start_time',
+                 'end_time', 'active_time', 'QoS', 'active', 'accepted')
     id_iter = itertools.count()
 
     def __init__(self, controller, switches, TTL, QoS, time_, **kwargs):
@@ -100,8 +105,29 @@ class vSDN_request(object):
                                      self.TTL)
         # return f"{self.id}\t{self.controller}\t{self.switches}\t{self.TTL}"
 
-    def __getattribute__(self, name: str):
-        return object.__getattribute__(self, name)
+    def __getstate__(self):
+        return self.to_dict()
+
+    def __setstate__(self, state):
+        # Requests pickled before __slots__ have their __dict__ as state
+        if isinstance(state, tuple):
+            state = {**(state[0] or {}), **state[1]}
+        for name, value in state.items():
+            if name in vSDN_request.__slots__:
+                setattr(self, name, value)
+
+    def to_dict(self) -> dict:
+        # Subclasses that only add behaviour declare empty __slots__
+        return {name: getattr(self, name) for name in vSDN_request.__slots__}
+
+    def copy(self):
+        """Copy of the request with its own switch list,
+        a cheaper replacement of copy.deepcopy."""
+        request = object.__new__(type(self))
+        for name in vSDN_request.__slots__:
+            setattr(request, name, getattr(self, name))
+        request.switches = list(self.switches)
+        return request
 
     def get_id(self):
         return self.id
@@ -121,6 +147,10 @@ class vSDN_request(object):
     def get_start_time(self):
         return self.start_time
 
+    def set_start_time(self, t):
+        self.start_time = t
+        self.end_time = t + self.TTL
+
     def set_end_time(self, t):
         self.end_time = t
         self.active_time = t - self.start_time
@@ -154,6 +184,52 @@ class vSDN_request(object):
         return metrics.metrics[metric](self)
 
 
+def get_switch_matrix(switch_lists, n_nodes):
+    """CSR matrix with a row per request and a one for each of its switches."""
+    indptr = np.cumsum([0] + [len(switches) for switches in switch_lists])
+    indices = np.fromiter(itertools.chain.from_iterable(switch_lists),
+                          dtype=np.int64,
+                          count=indptr[-1])
+    return scipy.sparse.csr_matrix(
+        (np.ones(len(indices), dtype=np.int32), indices, indptr),
+        shape=(len(switch_lists), n_nodes))
+
+
+def get_line_offsets(file_path, chunk_size: int = 2**24) -> np.ndarray:
+    """Start offsets of the lines of a file.
+
+    The offsets are kept as uint64 in a sidecar .idx file next to the
+    file, which is rebuilt when it is older than the file."""
+    index_path = f"{file_path}.idx"
+    if (os.path.isfile(index_path)
+            and os.path.getmtime(index_path) >= os.path.getmtime(file_path)):
+        if os.path.getsize(index_path) == 0:
+            return np.zeros(0, dtype=np.uint64)
+        return np.memmap(index_path, dtype=np.uint64, mode='r')
+
+    newlines, position, last = [], 0, b'\n'
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            newlines.append(
+                np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == 10) +
+                position)
+            position += len(chunk)
+            last = chunk[-1:]
+    # A line starts after every newline, except after the one ending the file
+    offsets = np.concatenate([np.zeros(1, dtype=np.int64)] +
+                             [x + 1 for x in newlines]).astype(np.uint64)
+    if last == b'\n':
+        offsets = offsets[:-1]
+    try:
+        offsets.tofile(index_path)
+    except OSError:
+        logging.warning(f"Could not write the line index {index_path}")
+    return offsets
+
+
 class vSDN_request_generator:
     def __init__(self,
                  network_name,
@@ -169,45 +245,129 @@ class vSDN_request_generator:
     def get_seed(self):
         return self.seed
 
-    def TTL_generator(self, min_TTL: int = 1, max_TTL: int = 10, **kwargs):
+    def TTL_generator(self,
+                      min_TTL: int = 1,
+                      max_TTL: int = 10,
+                      size: int = None,
+                      **kwargs):
+        if size is not None:
+            return self.random_generator.integers(min_TTL, max_TTL, size)
         return self.random_generator.integers(min_TTL, max_TTL, 1)[0]
 
-    def QoS_generator(self, min_QoS: int = 1, max_QoS: int = 3, **kwargs):
+    def QoS_generator(self,
+                      min_QoS: int = 1,
+                      max_QoS: int = 3,
+                      size: int = None,
+                      **kwargs):
+        if size is not None:
+            return self.random_generator.integers(min_QoS, max_QoS, size)
         return self.random_generator.integers(min_QoS, max_QoS, 1)[0]
 
     def get_request_file_path(self, request_size):
         return f"{self._request_folder}{self._network_name}.{str(request_size)}.subgraphs"
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_request_files'] = {}
+        return state
+
     def build_request_file_dict(self) -> None:
+        """Find the request files of every request size.
+
+        Binary files written by enucon with --binary
+        (.subgraphs.uint8 or .subgraphs.uint16) are preferred."""
         self.request_file_dict = {}
+        self._request_files = {}
         for request_file_path in sorted(
-                glob.glob(self.get_request_file_path('*'))):
-            m = re.search('(\d+)\.subgraphs', request_file_path)
+                glob.glob(self.get_request_file_path('*') + '*')):
+            m = re.search(r'(\d+)\.subgraphs(\.uint8|\.uint16)?$',
+                          request_file_path)
+            if m is None:
+                continue
             request_size = int(m.group(1))
+            if m.group(2):
+                file_size = len(self.get_subgraphs(request_file_path))
+            elif request_size in self.request_file_dict:
+                continue
+            else:
+                file_size = len(get_line_offsets(request_file_path))
             self.request_file_dict[request_size] = {
                 'file_path': request_file_path,
-                'file_size': sum(1 for _ in open(request_file_path, 'r'))
+                'file_size': file_size
             }
         # print(self.request_file_dict)
         return
 
-    def get_request_from_file(self, request_file_path, line_index,
-                              **kwargs) -> vSDN_request:
-        switches = [
-            int(s)
-            for s in linecache.getline(request_file_path, line_index).split()
-        ]
+    def get_subgraphs(self, request_file_path) -> np.ndarray:
+        """Memory-mapped (n_subgraphs, request_size) array of a binary
+        request file."""
+        if request_file_path not in self._request_files:
+            m = re.search(r'(\d+)\.subgraphs\.(uint8|uint16)$',
+                          request_file_path)
+            request_size, dtype = int(m.group(1)), m.group(2)
+            if os.path.getsize(request_file_path):
+                subgraphs = np.memmap(request_file_path, dtype=dtype,
+                                      mode='r').reshape(-1, request_size)
+            else:
+                subgraphs = np.zeros((0, request_size), dtype=dtype)
+            self._request_files[request_file_path] = subgraphs
+        return self._request_files[request_file_path]
+
+    def get_line(self, request_file_path, line_index) -> bytes:
+        """Line of a request file by its 1-based index, read through mmap
+        and the line offsets; empty if the line does not exist."""
+        if request_file_path not in self._request_files:
+            offsets = get_line_offsets(request_file_path)
+            with open(request_file_path, 'rb') as f:
+                lines = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ
+                                  ) if len(offsets) else b''
+            self._request_files[request_file_path] = (lines, offsets)
+        lines, offsets = self._request_files[request_file_path]
+        line_index = int(line_index)
+        if not 1 <= line_index <= len(offsets):
+            return b''
+        end = offsets[line_index] if line_index < len(offsets) else len(lines)
+        return lines[offsets[line_index - 1]:end]
+
+    def get_switches_from_file(self, request_file_path, line_indexes) -> list:
+        """Switches of the subgraphs in the 1-based lines of a request file,
+        empty for lines that do not exist.
+
+        The rows of a binary file are read at once by fancy indexing."""
+        if not request_file_path.endswith(('.uint8', '.uint16')):
+            return [[int(s) for s in self.get_line(request_file_path,
+                                                   line_index).split()]
+                    for line_index in line_indexes]
+        subgraphs = self.get_subgraphs(request_file_path)
+        line_indexes = np.asarray(line_indexes, dtype=np.int64)
+        valid = (line_indexes >= 1) & (line_indexes <= len(subgraphs))
+        rows = iter(subgraphs[line_indexes[valid] - 1].tolist())
+        return [next(rows) if valid_ else [] for valid_ in valid]
+
+    def get_request_from_switches(self,
+                                  switches,
+                                  TTL: int = None,
+                                  QoS: int = None,
+                                  **kwargs) -> vSDN_request:
         # print(line_index, switches)
         controller = None
         # self.random_generator.choice(switches)  # ! controller selection
-        TTL = self.TTL_generator(**kwargs)
-        QoS = self.QoS_generator(**kwargs)
+        if TTL is None:
+            TTL = self.TTL_generator(**kwargs)
+        if QoS is None:
+            QoS = self.QoS_generator(**kwargs)
         return vSDN_request(controller=controller,
                             switches=switches,
                             TTL=TTL,
                             QoS=QoS,
                             **kwargs)
 
+    def get_request_from_file(self, request_file_path, line_index,
+                              **kwargs) -> vSDN_request:
+        return self.get_request_from_switches(
+            self.get_switches_from_file(request_file_path, [line_index])[0],
+            **kwargs)
+
     def get_request(self, request_size, **kwargs) -> vSDN_request:
         request_file_path = self.request_file_dict[request_size]['file_path']
         line_index = self.random_generator.integers(
@@ -237,14 +397,22 @@ class vSDN_request_generator:
                                                     replace=False)
 
         return [
-            self.get_request_from_file(request_file_path, line_index, **kwargs)
-            for line_index in line_indexes
+            self.get_request_from_switches(switches, **kwargs)
+            for switches in self.get_switches_from_file(
+                request_file_path, line_indexes)
         ], coverage, number_of_requests
 
     def get_random_vSDN_requests(self,
                                  max_request_size: typing.Optional[int] = None,
                                  total_count: int = 100,
+                                 bulk_sampling: bool = False,
                                  **kwargs) -> List[vSDN_request]:
+        """Sample requests uniformly from the subgraphs of all request files
+        up to max_request_size.
+
+        The TTL and QoS of each request are drawn one after the other. With
+        bulk_sampling all TTLs and then all QoS values are drawn as arrays
+        instead, which is faster but gives a different random stream."""
         request_sizes = sorted([
             size for size in self.request_file_dict.keys()
             if size <= max_request_size
@@ -252,19 +420,42 @@ class vSDN_request_generator:
         request_file_sizes = [
             self.request_file_dict[size]['file_size'] for size in request_sizes
         ]
-        cum_request_file_sizes = [
-            sum(request_file_sizes[:i]) for i in range(len(request_file_sizes))
-        ]
+        cum_request_file_sizes = np.cumsum([0] + request_file_sizes[:-1])
         request_indexes = self.random_generator.integers(
             1, sum(request_file_sizes), total_count)
 
-        request_list = []
-        for index in request_indexes:
-            diff = index - np.array(cum_request_file_sizes)
-            request_size_index = np.where(diff > 0, diff, np.inf).argmin()
-            line_index = diff[request_size_index]
-            request_list.append(
-                self.get_request_from_file(
-                    self.request_file_dict[request_sizes[request_size_index]]
-                    ['file_path'], line_index, **kwargs))
-        return request_list
+        # First file with the largest cumulative size below each index
+        request_size_indexes = np.searchsorted(
+            cum_request_file_sizes,
+            cum_request_file_sizes[np.searchsorted(
+                cum_request_file_sizes, request_indexes, side='left') - 1],
+            side='left')
+        line_indexes = request_indexes - cum_request_file_sizes[
+            request_size_indexes]
+
+        request_switches = [None] * total_count
+        for request_size_index in np.unique(request_size_indexes):
+            positions = np.flatnonzero(
+                request_size_indexes == request_size_index)
+            for position, switches in zip(
+                    positions,
+                    self.get_switches_from_file(
+                        self.request_file_dict[
+                            request_sizes[request_size_index]]['file_path'],
+                        line_indexes[positions])):
+                request_switches[position] = switches
+
+        if bulk_sampling:
+            TTLs = self.TTL_generator(**dict(kwargs, size=total_count))
+            QoSs = self.QoS_generator(**dict(kwargs, size=total_count))
+            return [
+                self.get_request_from_switches(switches,
+                                               TTL=TTL,
+                                               QoS=QoS,
+                                               **kwargs)
+                for switches, TTL, QoS in zip(request_switches, TTLs, QoSs)
+            ]
+        return [
+            self.get_request_from_switches(switches, **kwargs)
+            for switches in request_switches
+        ]
@@ -62,6 +62,9 @@ hp_algo_settings = {
     'n_diff_hypervisors': [0],
     'flexibility_weight': [None],
     'repeat': [10],
+    'repeat_workers': [None],
+    'repeat_patience': [None],
+    'repeat_pool_size': [None],
     'heuristic_randomness': [0.2],
     'path2model': ['../models/'],
     'model_name': ['gnn_model_italy_0.5_2000'],
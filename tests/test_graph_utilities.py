@@ -0,0 +1,136 @@
+import itertools
+import pathlib
+
+import networkx as nx
+import numpy as np
+import pytest
+
+import src.data.graph_utilities as gu
+import src.data.routing as routing
+
+NETWORKS = pathlib.Path(__file__).parents[1] / 'data/processed/networks'
+
+
+def get_paths(network_name, latency_factor, shortest_k=16):
+    G = nx.read_gml(NETWORKS / f'{network_name}.gml', label='id')
+    max_length = latency_factor * int(gu.get_graph_diameter(G))
+    all_paths = routing.get_all_paths(G=G,
+                                      max_length=max_length,
+                                      shortest_k=shortest_k)
+    return list(G.nodes), all_paths, max_length
+
+
+@pytest.fixture(scope='module', params=[0.5, 1.0])
+def italy(request):
+    return get_paths('25_italy', request.param)
+
+
+def random_masks(rng, n_arrays, max_rows, n_words=2):
+    return [
+        rng.integers(0, 2**62, (rng.integers(0, max_rows), n_words),
+                     dtype=np.uint64) & rng.integers(
+                         0, 2**62, (1, n_words), dtype=np.uint64)
+        for _ in range(n_arrays)
+    ]
+
+
+def disjoint_pairs(A_list, B_list):
+    return np.array([[
+        any(not (a & b).any() for a, b in itertools.product(A, B))
+        for B in B_list
+    ] for A in A_list])
+
+
+def test_disjoint_pair_matrix():
+    rng = np.random.default_rng(0)
+    A_list = random_masks(rng, 6, 20)
+    B_list = random_masks(rng, 7, 20)
+    expected = disjoint_pairs(A_list, B_list)
+    for chunk_size in (1, 64, 2**22):
+        np.testing.assert_array_equal(
+            gu.disjoint_pair_matrix(A_list, B_list, chunk_size=chunk_size),
+            expected)
+
+
+def test_disjoint_pair_matrix_symmetric():
+    rng = np.random.default_rng(1)
+    A_list = random_masks(rng, 8, 20)
+    expected = np.triu(disjoint_pairs(A_list, A_list), k=1)
+    np.testing.assert_array_equal(
+        gu.disjoint_pair_matrix(A_list, A_list, symmetric=True), expected)
+
+
+def test_construct_quartets_vectorized(italy):
+    nodes, all_paths, max_length = italy
+    C = nodes[:5]
+    loop = gu.construct_quartets(C, nodes, nodes, all_paths, max_length,
+                                 vectorized=False)
+    vectorized = gu.construct_quartets(C, nodes, nodes, all_paths,
+                                       max_length, vectorized=True)
+    assert vectorized == loop
+
+
+def test_disjoint_pair_bounds():
+    rng = np.random.default_rng(2)
+    A_list = random_masks(rng, 6, 20)
+    la_list = [rng.random(len(A)) for A in A_list]
+    expected = np.array([[
+        min((max(la, lb) for (a, la), (b, lb) in itertools.product(
+            zip(A, la_), zip(B, lb_)) if not (a & b).any()),
+            default=np.inf) for B, lb_ in zip(A_list, la_list)
+    ] for A, la_ in zip(A_list, la_list)])
+    for chunk_size in (1, 64, 2**22):
+        np.testing.assert_array_equal(
+            gu.disjoint_pair_bounds(A_list, A_list, la_list, la_list,
+                                    chunk_size=chunk_size), expected)
+    bounds = gu.disjoint_pair_bounds(A_list,
+                                     A_list,
+                                     la_list,
+                                     la_list,
+                                     symmetric=True)
+    upper = np.triu(np.ones(expected.shape, dtype=bool), k=1)
+    np.testing.assert_array_equal(bounds[upper], expected[upper])
+    assert np.isinf(bounds[~upper]).all()
+
+
+def random_triplets(rng, n_nodes, n_triplets):
+    Tc = {}
+    for c, f, f_ in rng.integers(0, n_nodes, (n_triplets, 3)).tolist():
+        Tc.setdefault(c, []).append((c, f, f_))
+    return Tc
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_coverage_engine(seed):
+    rng = np.random.default_rng(seed)
+    C, Tc = list(range(30)), random_triplets(rng, 30, 200)
+    F = sorted(rng.choice(30, 20, replace=False).tolist())
+    engine = gu.CoverageEngine(C, F, Tc)
+    for _ in range(20):
+        F_used = set(rng.choice(F, rng.integers(0, 6)).tolist())
+        engine.set_facilities(F_used)
+        covered = gu.covered_customers(Tc, F_used, C)
+        assert engine.covered_customers() == covered
+
+        gains, pair_gains = engine.get_gains(), engine.get_pair_gains()
+        for i, f in enumerate(F):
+            assert len(covered) + gains[i] == len(
+                gu.covered_customers(Tc, F_used | {f}, C))
+            for j, f_ in enumerate(F):
+                assert len(covered) + pair_gains[i, j] == len(
+                    gu.covered_customers(Tc, F_used | {f, f_}, C))
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2000, 2**22])
+def test_covered_customers_batch(chunk_size):
+    rng = np.random.default_rng(0)
+    C, Tc = list(range(30)), random_triplets(rng, 30, 200)
+    F_batch = [
+        rng.choice(30, rng.integers(0, 6), replace=False).tolist()
+        for _ in range(50)
+    ]
+    covered = gu.covered_customers_batch(Tc, F_batch, C[5:],
+                                         chunk_size=chunk_size)
+    for F, row in zip(F_batch, covered):
+        assert [C[5 + i] for i in np.flatnonzero(row)
+                ] == gu.covered_customers(Tc, F, C[5:])
@@ -0,0 +1,119 @@
+import itertools
+import pathlib
+
+import numpy as np
+import pytest
+
+import src.models.hypervisor_placement as hp
+from src.models.network_operator import NetworkOperator
+from src.models.vSDN_request import vSDN_request
+
+NETWORK_PATH = str(
+    pathlib.Path(__file__).parents[1] / 'data/processed/networks/37_cost.gml')
+
+
+@pytest.fixture(scope='module')
+def network_operator():
+    network_operator = NetworkOperator(path=NETWORK_PATH)
+    network_operator.set_max_length(latency_factor=0.5)
+    network_operator.set_shortest_k(shortest_k=16)
+    network_operator.control_path_calculation()
+    return network_operator
+
+
+@pytest.mark.parametrize('heuristic_name', ['greedy_max_cover',
+                                            'hp_combined_S_CS'])
+@pytest.mark.parametrize('repeat_patience', [None, 5])
+def test_heuristic_repeated_seed(network_operator, heuristic_name,
+                                 repeat_patience):
+    kwargs = dict(network_operator=network_operator,
+                  n_hypervisors=6,
+                  heuristic_randomness=0.3)
+    pools = [
+        hp.SolutionPool(repeat_patience)
+        if repeat_patience is not None else None for _ in range(2)
+    ]
+    serial = hp.heuristic_repetitions_serial(heuristic_name,
+                                             20,
+                                             repeat_seed=3,
+                                             solution_pool=pools[0],
+                                             **kwargs)
+    parallel = hp.heuristic_repetitions_parallel(heuristic_name,
+                                                 20,
+                                                 repeat_workers=2,
+                                                 repeat_seed=3,
+                                                 solution_pool=pools[1],
+                                                 **kwargs)
+    assert serial[0] == parallel[0]
+    assert ([s['active_hypervisors'] for s in serial[1]
+             ] == [s['active_hypervisors'] for s in parallel[1]])
+
+    selected = []
+    for repeat_workers in (None, 2):
+        np.random.seed(0)
+        selected.append(
+            hp.heuristic_repeated(heuristic_name,
+                                  repeat=20,
+                                  repeat_workers=repeat_workers,
+                                  repeat_seed=3,
+                                  repeat_patience=repeat_patience,
+                                  **kwargs)['active_hypervisors'])
+    assert selected[0] == selected[1]
+
+
+def request_coverage_per_request(S, C, H_notused, H_used, Qhh, Qcs, R):
+    """Additional request coverage computed with per-request masks."""
+    RS_mask = np.zeros((len(R), len(C), len(S)), dtype=bool)
+    for r_idx, request in enumerate(R):
+        for s in request.get_switches():
+            RS_mask[r_idx, :, S.index(s)] = True
+    RCS_mask = np.zeros((len(R), len(C), len(S)), dtype=bool)
+    for c_idx, c in enumerate(C):
+        for s in S:
+            if len(Qcs.get((c, s), [])):
+                RCS_mask[:, c_idx, S.index(s)] = True
+    C_mask = (RCS_mask & RS_mask).sum(axis=2) == RS_mask.sum(axis=2)
+    RCS_mask &= RS_mask & C_mask[:, :, np.newaxis]
+
+    def CS_mask(H_):
+        CS = np.zeros((len(C), len(S)), dtype=bool)
+        for h, h_ in itertools.product(H_, H_):
+            for c, s in Qhh.get((h, h_), []):
+                CS[C.index(c), S.index(s)] = True
+        return CS
+
+    current = np.sum(CS_mask(H_used) & RCS_mask)
+    return {
+        h: np.sum(CS_mask([h] + list(H_used)) & RCS_mask) - current
+        for h in H_notused
+    }
+
+
+def test_request_coverage(network_operator):
+    S, C = network_operator.nodes, network_operator.possible_controllers
+    H = network_operator.possible_hypervisors
+    Qhh, Qcs = network_operator.quartets_by_hh, network_operator.quartets_by_cs
+    rng = np.random.default_rng(0)
+    R = [
+        vSDN_request(controller=None,
+                     switches=sorted(
+                         rng.choice(len(S), int(rng.integers(2, 8)),
+                                    replace=False).tolist()),
+                     TTL=5,
+                     QoS=1,
+                     time_=0) for _ in range(40)
+    ]
+    request_coverage = hp.RequestCoverage(
+        S, C, Qcs, R, network_operator.get_hypervisor_pair_incidence())
+
+    H_used = []
+    for h in rng.choice(H, 4, replace=False).tolist():
+        request_coverage.add(h, H_used)
+        H_used.append(h)
+        H_notused = list(set(H) - set(H_used))
+        expected = request_coverage_per_request(S, C, H_notused, H_used, Qhh,
+                                                Qcs, R)
+        assert hp.get_hypervisor_additional_request_coverage(
+            S, C, H, H_used, Qhh, Qcs, R) == expected
+        assert hp.get_hypervisor_additional_request_coverage(
+            S, C, H, H_used, Qhh, Qcs, R, request_coverage) == expected
@@ -0,0 +1,211 @@
+import pathlib
+import random
+import shutil
+
+import numpy as np
+import pytest
+
+from src.models import controller_placement, metrics
+from src.models.network_operator import NetworkOperator
+from src.models.vSDN_request import vSDN_request
+
+NETWORKS = pathlib.Path(__file__).parents[1] / 'data/processed/networks'
+NETWORK_PATH = str(NETWORKS / '25_italy.gml')
+
+QUARTET_ATTRIBUTES = [
+    'quartets', 'quartets_by_controllers', 'quartets_by_switches',
+    'quartets_by_cs', 'quartets_by_hh'
+]
+TRIPLET_ATTRIBUTES = [
+    'triplets', 'triplets_by_hypervisors', 'triplets_by_switches'
+]
+
+
+PLACEMENT_SETTINGS = dict(hp_type='heuristics',
+                          hp_objective='hypervisor count',
+                          n_extra_hypervisors=0,
+                          repeat=3,
+                          heuristic_randomness=0.2)
+
+
+def get_network_operator(latency_factor, path=NETWORK_PATH, **kwargs):
+    """Network operator built with the settings of init_simulation."""
+    settings = dict(kwargs, latency_factor=latency_factor, shortest_k=16)
+    network_operator = NetworkOperator(path=path)
+    network_operator.set_max_length(**settings)
+    network_operator.set_shortest_k(**settings)
+    network_operator.control_path_calculation(**settings)
+    return network_operator
+
+
+@pytest.fixture(scope='module')
+def base_network_operator():
+    return get_network_operator(1.0, with_bounds=True)
+
+
+@pytest.mark.parametrize('latency_factor', [0.5, 0.6])
+def test_derive_network_operator(base_network_operator, latency_factor):
+    derived = base_network_operator.derive_network_operator(latency_factor)
+    direct = get_network_operator(latency_factor)
+    for name in QUARTET_ATTRIBUTES + TRIPLET_ATTRIBUTES:
+        assert getattr(derived, name) == getattr(direct, name), name
+    assert (derived.Qfeas == direct.Qfeas).all()
+    assert derived.info['n_quartets'] == direct.info['n_quartets']
+    for key in direct.possible_paths:
+        assert ([p['path'] for p in derived.possible_paths[key]
+                 ] == [p['path'] for p in direct.possible_paths[key]])
+
+
+def test_derive_network_operator_placement():
+    path = str(NETWORKS / '26_usa.gml')
+    derived = get_network_operator(
+        1.0, path, with_bounds=True).derive_network_operator(0.5)
+    direct = get_network_operator(0.5, path)
+    assert ([len(derived.possible_paths[key]) for key in direct.possible_paths
+             ] == [len(direct.possible_paths[key])
+                   for key in direct.possible_paths])
+
+    placements = []
+    for network_operator in (derived, direct):
+        random.seed(2)
+        np.random.seed(2)
+        network_operator.hypervisor_placement(n_hypervisors=6,
+                                              **PLACEMENT_SETTINGS)
+        placements.append((network_operator.active_hypervisors,
+                           network_operator.hypervisor_assignment))
+    assert placements[0] == placements[1]
+
+
+def test_load_moved_artifacts(base_network_operator, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'saved').mkdir()
+    base_network_operator.save_artifacts('saved')
+    shutil.move('saved', 'moved')
+    (tmp_path / 'elsewhere').mkdir()
+    monkeypatch.chdir(tmp_path / 'elsewhere')
+
+    loaded = NetworkOperator.load('../moved')
+    for key in base_network_operator.possible_paths:
+        assert (loaded.possible_paths[key] ==
+                base_network_operator.possible_paths[key])
+    assert loaded.quartets == base_network_operator.quartets
+
+
+def test_derive_network_operator_looser(base_network_operator):
+    with pytest.raises(ValueError, match='latency factor 1.5'):
+        base_network_operator.derive_network_operator(1.5)
+
+
+@pytest.fixture(scope='module')
+def placed_network_operator():
+    network_operator = get_network_operator(0.6)
+    random.seed(0)
+    np.random.seed(0)
+    network_operator.hypervisor_placement(n_hypervisors=4,
+                                          **PLACEMENT_SETTINGS)
+    return network_operator
+
+
+def get_requests(n_nodes, count=60, seed=0):
+    rng = np.random.default_rng(seed)
+    requests = []
+    for _ in range(count):
+        switches = sorted(
+            rng.choice(n_nodes, int(rng.integers(2, 7)),
+                       replace=False).tolist())
+        requests.append(
+            vSDN_request(controller=int(rng.choice(switches)),
+                         switches=switches,
+                         TTL=int(rng.integers(1, 6)),
+                         QoS=1,
+                         time_=0))
+    return requests
+
+
+def assert_active_index(network_operator):
+    """The active vSDN index equals a full scan of the vSDNs."""
+    active = [v for v in network_operator.vSDNs.values() if v.is_active()]
+    assert (sorted(network_operator.get_active_vSDNs(only_ids=True)) ==
+            sorted(v.get_id() for v in active))
+    assert network_operator.get_active_vSDN_count() == len(active)
+    assert network_operator.get_switch_load_total() == sum(
+        v.get_size() for v in active)
+    assert network_operator.get_revenue_total() == sum(
+        int(metrics.revenue(v)) for v in active)
+    assert network_operator.get_revenue_total(one_timestep=True) == sum(
+        int(metrics.revenue(v, one_timestep=True)) for v in active)
+    assert (sorted(network_operator.get_active_controllers()) == sorted(
+        v.get_controller() for v in active))
+
+    controllers_by_switch = {}
+    for v in active:
+        for s in v.get_switches():
+            controllers = controllers_by_switch.setdefault(s, {})
+            controllers[v.get_controller()] = controllers.get(
+                v.get_controller(), 0) + 1
+    assert network_operator.active_controllers_by_switch == (
+        controllers_by_switch)
+    assert {(v.get_end_time(), v.get_id())
+            for v in active} <= set(network_operator.expiry_heap)
+
+
+def test_active_vSDN_index(placed_network_operator):
+    network_operator = placed_network_operator
+    network_operator.delete_all_vSDNs()
+    requests = get_requests(len(network_operator.nodes))
+
+    random.seed(1)
+    accepted = network_operator.process_vSDN_requests(requests, time=0)
+    assert any(accepted)
+    assert_active_index(network_operator)
+
+    # The requests of the list are active now, processing them again after
+    # deleting the vSDNs must not use index entries that do not exist
+    network_operator.delete_all_vSDNs()
+    random.seed(1)
+    network_operator.process_vSDN_requests(requests, time=0)
+    assert_active_index(network_operator)
+
+    network_operator.deactivate_old_vSDNs(2)
+    assert_active_index(network_operator)
+    assert all(v.get_end_time() > 2
+               for v in network_operator.get_active_vSDNs())
+
+    network_operator.deactivate_all_vSDNs()
+    assert_active_index(network_operator)
+    assert network_operator.get_active_vSDN_count() == 0
+    network_operator.delete_all_vSDNs()
+
+
+def test_process_vSDN_requests_batch(placed_network_operator):
+    network_operator = placed_network_operator
+    network_operator.delete_all_vSDNs()
+    requests = get_requests(len(network_operator.nodes), count=100, seed=1)
+
+    # Acceptance does not depend on the controller choice
+    random.seed(0)
+    accepted = network_operator.process_vSDN_requests(requests, deploy=False)
+    assert 0 < sum(accepted) < len(requests)
+    assert network_operator.process_vSDN_requests_batch(
+        requests, deploy=False) == accepted
+
+    # With a possible controller in each request both choose the same one
+    for request in requests:
+        possible_controllers = controller_placement.find_possible_controllers(
+            network_operator, request)
+        if possible_controllers:
+            request.set_controller(min(possible_controllers))
+
+    results = []
+    for process in (network_operator.process_vSDN_requests,
+                    network_operator.process_vSDN_requests_batch):
+        network_operator.delete_all_vSDNs()
+        accepted = process(requests, time=0)
+        network_operator.get_control_path_stats()
+        results.append(
+            (accepted, network_operator.get_active_vSDNs(only_ids=True), {
+                id: vSDN.get_controller()
+                for id, vSDN in network_operator.vSDNs.items()
+            }, network_operator.cp_stats))
+    assert results[0] == results[1]
+    network_operator.delete_all_vSDNs()
@@ -0,0 +1,76 @@
+import pathlib
+import pickle
+
+import networkx as nx
+import numpy as np
+import pytest
+
+import src.data.graph_utilities as gu
+import src.data.routing as routing
+from src.data.path_store import PathStore
+
+NETWORKS = pathlib.Path(__file__).parents[1] / 'data/processed/networks'
+
+
+@pytest.fixture(scope='module')
+def italy_paths():
+    G = nx.read_gml(NETWORKS / '25_italy.gml', label='id')
+    max_length = int(gu.get_graph_diameter(G))
+    all_paths = routing.get_all_paths(G=G,
+                                      max_length=max_length,
+                                      shortest_k=16)
+    return all_paths, PathStore.from_paths(all_paths,
+                                           routing.get_edge_index(G))
+
+
+def assert_same_paths(store, all_paths):
+    assert set(store) == set(all_paths)
+    assert len(store) == len(all_paths)
+    for key, paths in all_paths.items():
+        assert store.count(key) == len(paths)
+        assert store[key] == paths
+
+
+def test_from_paths(italy_paths):
+    all_paths, store = italy_paths
+    assert_same_paths(store, all_paths)
+
+
+def test_save_load(italy_paths, tmp_path):
+    all_paths, store = italy_paths
+    store.save(tmp_path)
+    loaded = PathStore.load(tmp_path)
+    assert isinstance(loaded.masks, np.memmap)
+    assert_same_paths(loaded, all_paths)
+    assert_same_paths(pickle.loads(pickle.dumps(loaded)), all_paths)
+
+
+def test_pickle_relative_folder(italy_paths, tmp_path, monkeypatch):
+    all_paths, store = italy_paths
+    monkeypatch.chdir(tmp_path)
+    store.save('paths')
+    data = pickle.dumps(PathStore.load('paths'))
+    (tmp_path / 'elsewhere').mkdir()
+    monkeypatch.chdir(tmp_path / 'elsewhere')
+    assert_same_paths(pickle.loads(data), all_paths)
+
+
+def test_pickle_without_folder(italy_paths):
+    all_paths, store = italy_paths
+    store = PathStore(*(getattr(store, name) for name in store.array_names))
+    assert_same_paths(pickle.loads(pickle.dumps(store)), all_paths)
+
+
+def test_filter(italy_paths):
+    all_paths, store = italy_paths
+    max_length = np.median(store.lengths)
+    assert_same_paths(store.filter(max_length),
+                      routing.filter_paths(all_paths, max_length))
+
+
+def test_path_arrays(italy_paths):
+    all_paths, store = italy_paths
+    expected = gu.get_path_arrays(all_paths)
+    for key, (lengths, masks) in store.path_arrays().items():
+        np.testing.assert_array_equal(lengths, expected[key][0])
+        np.testing.assert_array_equal(masks, expected[key][1])
@@ -0,0 +1,33 @@
+import pathlib
+
+import networkx as nx
+import pytest
+
+import src.data.graph_utilities as gu
+import src.data.routing as routing
+
+NETWORKS = pathlib.Path(__file__).parents[1] / 'data/processed/networks'
+
+
+@pytest.mark.parametrize('network_name', ['25_italy', '26_usa'])
+@pytest.mark.parametrize('latency_factor', [0.5, 1.0])
+def test_get_all_paths_batched(network_name, latency_factor):
+    G = nx.read_gml(NETWORKS / f'{network_name}.gml', label='id')
+    max_length = latency_factor * int(gu.get_graph_diameter(G))
+    batched_limits, limits = {}, {}
+    batched = routing.get_all_paths(G=G,
+                                    max_length=max_length,
+                                    shortest_k=16,
+                                    path_limits=batched_limits)
+    per_pair = routing.get_all_paths(G=G,
+                                     max_length=max_length,
+                                     shortest_k=16,
+                                     batched=False,
+                                     path_limits=limits)
+    assert batched.keys() == per_pair.keys()
+    for key, paths in per_pair.items():
+        assert [p['path'] for p in batched[key]] == [p['path'] for p in paths]
+        assert [p['mask'] for p in batched[key]] == [p['mask'] for p in paths]
+        assert [p['length'] for p in batched[key]
+                ] == pytest.approx([p['length'] for p in paths])
+        assert (batched_limits[key] == 'k') == (limits[key] == 'k')
@@ -0,0 +1,123 @@
+import linecache
+import pickle
+
+import numpy as np
+import pytest
+
+from src.models.vSDN_request import vSDN_request, vSDN_request_generator
+
+
+class SubclassedRequest(vSDN_request):
+    __slots__ = ()
+
+
+def get_request(request_class=vSDN_request):
+    request = request_class(controller=1,
+                            switches=[1, 2, 5],
+                            TTL=4,
+                            QoS=2,
+                            time_=3)
+    request.set_active()
+    return request
+
+
+def test_copy():
+    request = get_request()
+    copied = request.copy()
+    assert copied.to_dict() == request.to_dict()
+    copied.get_switches().append(7)
+    assert request.get_switches() == [1, 2, 5]
+
+
+def test_copy_subclass():
+    request = get_request(SubclassedRequest)
+    copied = request.copy()
+    assert type(copied) is SubclassedRequest
+    assert copied.to_dict() == request.to_dict()
+
+
+def test_pickle():
+    request = get_request()
+    assert pickle.loads(pickle.dumps(request)).to_dict() == request.to_dict()
+
+
+@pytest.fixture
+def request_folder(tmp_path):
+    rng = np.random.default_rng(0)
+    for size, count in [(2, 40), (3, 25), (4, 60)]:
+        lines = [
+            ' '.join(map(str, rng.choice(30, size, replace=False)))
+            for _ in range(count)
+        ]
+        # The last file does not end with a newline
+        (tmp_path / f'test.{size}.subgraphs').write_text(
+            '\n'.join(lines) + ('\n' if size < 4 else ''))
+    return f'{tmp_path}/'
+
+
+def get_requests_per_line(generator, max_request_size, total_count):
+    """Requests drawn one by one and read with linecache."""
+    request_sizes = sorted(size for size in generator.request_file_dict
+                           if size <= max_request_size)
+    file_sizes = [
+        generator.request_file_dict[size]['file_size']
+        for size in request_sizes
+    ]
+    cum_file_sizes = np.array(
+        [sum(file_sizes[:i]) for i in range(len(file_sizes))])
+    requests = []
+    for index in generator.random_generator.integers(1, sum(file_sizes),
+                                                     total_count):
+        diff = index - cum_file_sizes
+        i = np.where(diff > 0, diff, np.inf).argmin()
+        file_path = generator.request_file_dict[request_sizes[i]]['file_path']
+        requests.append(([
+            int(s) for s in linecache.getline(file_path, int(diff[i])).split()
+        ], generator.TTL_generator(), generator.QoS_generator()))
+    return requests
+
+
+def as_tuples(requests):
+    return [(request.get_switches(), request.get_TTL(), request.get_QoS())
+            for request in requests]
+
+
+def test_get_switches_from_file(request_folder):
+    generator = vSDN_request_generator('test', request_folder)
+    rng = np.random.default_rng(1)
+    for size in (2, 3, 4):
+        file_path = generator.request_file_dict[size]['file_path']
+        file_size = generator.request_file_dict[size]['file_size']
+        assert file_size == len(linecache.getlines(file_path))
+        # Including the line indexes 0 and file_size + 1 that do not exist
+        line_indexes = rng.permutation(file_size + 2).tolist()
+        assert generator.get_switches_from_file(file_path, line_indexes) == [[
+            int(s) for s in linecache.getline(file_path, line_index).split()
+        ] for line_index in line_indexes]
+
+
+def test_get_random_vSDN_requests(request_folder):
+    expected = get_requests_per_line(
+        vSDN_request_generator('test', request_folder, seed=7), 4, 200)
+    generator = vSDN_request_generator('test', request_folder, seed=7)
+    requests = generator.get_random_vSDN_requests(4, 200, time_=0)
+    assert as_tuples(requests) == expected
+
+
+def test_get_random_vSDN_requests_bulk(request_folder):
+    expected = get_requests_per_line(
+        vSDN_request_generator('test', request_folder, seed=7), 3, 200)
+    # The TTLs and then the QoS values are drawn as arrays
+    random_generator = np.random.default_rng(7)
+    random_generator.integers(1, 40 + 25, 200)
+    TTLs = random_generator.integers(1, 10, 200).tolist()
+    QoSs = random_generator.integers(1, 3, 200).tolist()
+    generator = vSDN_request_generator('test', request_folder, seed=7)
+    requests = generator.get_random_vSDN_requests(3,
+                                                  200,
+                                                  bulk_sampling=True,
+                                                  time_=0)
+    assert as_tuples(requests) == [
+        (switches, TTL, QoS)
+        for (switches, _, _), TTL, QoS in zip(expected, TTLs, QoSs)
+    ]